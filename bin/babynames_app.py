@@ -1,12 +1,17 @@
 import streamlit as st
-import pandas as pd
 import dev.streamlit_helper_functions as sf
+import dev.dataset as ds
+import dev.kiez_map as kiez_map
+import dev.snapshots as snapshots
 
 
 if __name__ == "__main__":
     st.set_page_config(layout="wide")
+    # Sessions share one dataset, copy-on-write keeps them from altering it.
+    # The pandas option is process-wide, it applies to everything in the app.
+    ds.enable_copy_on_write()
     # Get data
-    url = "https://raw.githubusercontent.com/JustinZarb/babyNamesBerlin/master/data/names_combined_features.csv"
+    url = ds.default_source()
 
     def page_1():
         st.title("Berlin's Baby Names")
@@ -14,29 +19,44 @@ if __name__ == "__main__":
             """Explore Berlin's most popular open dataset: annual baby name data between 2012 and 2022. Data source: https://github.com/berlinonline/haeufige-vornamen-berlin """
         )
 
-        baby_names = pd.read_csv(url)
+        baby_names = ds.load_names(url)
         # baby_names = sf.first_names_only(baby_names)
 
         baby_names = sf.name_position_radio(baby_names)
         baby_names = sf.filter_gender(baby_names)
 
-        kiez_selection = sf.kiez_selector(baby_names)
-        name_selection = sf.name_selector(baby_names)
+        # pre-rendered figures and name profiles until a widget leaves its default
+        snapshot, profiles_source = None, None
+        if sf.at_defaults("name_position", "gender"):
+            snapshot = snapshots.default_snapshot(url, "home")
+            profiles_source = url
+
+        kiez_selection = sf.kiez_selector(baby_names, snapshot)
+        name_selection = sf.name_selector(baby_names, snapshot, profiles_source)
 
     def page_2():
         st.title("Exploring associated gender")
-        baby_names = pd.read_csv(url)
-        sf.gender_viz1(baby_names)
+        baby_names = ds.load_names(url)
+        sf.gender_viz1(baby_names, snapshots.default_snapshot(url, "genders"))
 
     def page_3():
         st.title("A deep dive into names")
         st.text("Let's look at different kinds of name similarity")
 
-        baby_names = pd.read_csv(url)
+        baby_names = ds.load_names(url)
         baby_names = sf.first_names_only(baby_names)
 
         sf.similar_names(baby_names)
 
+    def page_map():
+        st.title("Names across the kiez")
+        baby_names = ds.load_names(url)
+        sf.names_by_kiez(baby_names, ds.dataset_version(url))
+
+    def page_diversity():
+        st.title("How diverse are the names?")
+        sf.diversity_view(ds.load_diversity(url))
+
     def page_4():
         st.title("Predicting this year's names")
 
@@ -44,8 +64,13 @@ if __name__ == "__main__":
         "Home": page_1,
         "Genders": page_2,
         "Names": page_3,
+        "Map": page_map,
+        "Diversity": page_diversity,
         # "Forecast": page_4,
     }
+    # the map needs the bundled district geometry, see dev/kiez_map.py
+    if kiez_map.load_geometry() is None:
+        del pages["Map"]
 
     st.sidebar.title("Navigation")
     selection = st.sidebar.radio("Go to", list(pages.keys()))
@@ -0,0 +1,169 @@
+"""Local JSON api for the dashboard's queries
+
+Run from the bin folder:
+    python -m dev.api --port 8600 --source ../data/names_combined_features.csv
+
+Endpoints (all GET, list arguments are repeated, e.g. ?kiez=mitte&kiez=pankow):
+    /top_names?kiez=&jahr=&geschlecht=&position=&n=
+    /timeseries?vorname=&kiez=&geschlecht=
+    /gender_stats?position=
+    /gender_category?category=&position=
+    /similar_names?vorname=&n=
+    /diversity?position=
+
+Responses are cached per query and dataset version and carry an ETag, so
+clients sending If-None-Match get an empty 304, and a dataset swapped in by
+`dataset.write_arrow` is served from the next request on. Identical queries
+arriving while the first one is still being computed wait for that result
+instead of recomputing it.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+
+import tornado.ioloop
+import tornado.web
+
+import dev.dataset as ds
+import dev.queries as queries
+
+
+def _ints(values):
+    return [int(v) for v in values] if values else None
+
+
+QUERIES = {
+    "top_names": lambda names, args: queries.top_names(
+        names,
+        kiez=args.get("kiez"),
+        jahr=_ints(args.get("jahr")),
+        geschlecht=args.get("geschlecht"),
+        position=_ints(args.get("position")),
+        n=int(args.get("n", ["10"])[0]),
+    ),
+    "timeseries": lambda names, args: queries.name_timeseries(
+        names,
+        args["vorname"],
+        kiez=args.get("kiez"),
+        geschlecht=args.get("geschlecht"),
+    ),
+    "gender_stats": lambda names, args: queries.gender_category_counts(
+        names, position=_ints(args.get("position"))
+    ),
+    "gender_category": lambda names, args: queries.gender_category_names(
+        names, args["category"][0], position=_ints(args.get("position"))
+    ),
+    "similar_names": lambda names, args: queries.similar_names(
+        names, args["vorname"][0], n=int(args.get("n", ["10"])[0])
+    ),
+    "diversity": lambda names, args: queries.name_diversity(
+        names, position=_ints(args.get("position", ["1"]))
+    ),
+}
+
+
+class QueryCache:
+    """Serialized query results with their ETags, plus in-flight computations
+
+    Args:
+        source (str): url or path of names_combined_features.csv
+        max_entries (int, optional): cached results kept, oldest dropped first
+    """
+
+    def __init__(self, source: str, max_entries: int = 4096):
+        self.source = source
+        self.max_entries = max_entries
+        self.results = {}
+        self.pending = {}
+
+    def _compute(self, query: str, args: dict):
+        result = QUERIES[query](ds.load_names(self.source), args)
+        if hasattr(result, "to_dict"):
+            result = result.to_dict(orient="records")
+        body = json.dumps(result, default=str).encode()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        return etag, body
+
+    async def get(self, query: str, args: dict):
+        """Returns (etag, body) for a query, computing it at most once
+
+        Args:
+            query (str): one of QUERIES
+            args (dict): query arguments, each a list of strings
+
+        Returns:
+            tuple: quoted etag and JSON encoded body
+        """
+        # results of an older version age out of the cache
+        key = (
+            ds.dataset_version(self.source),
+            query,
+            tuple(sorted((k, tuple(v)) for k, v in args.items())),
+        )
+        if key in self.results:
+            return self.results[key]
+
+        if key not in self.pending:
+            loop = asyncio.get_running_loop()
+            self.pending[key] = loop.run_in_executor(None, self._compute, query, args)
+        try:
+            result = await self.pending[key]
+        finally:
+            self.pending.pop(key, None)
+
+        self.results[key] = result
+        if len(self.results) > self.max_entries:
+            del self.results[next(iter(self.results))]
+        return result
+
+
+class QueryHandler(tornado.web.RequestHandler):
+    def initialize(self, cache: QueryCache):
+        self.cache = cache
+        self.etag = None
+
+    async def get(self, query: str):
+        if query not in QUERIES:
+            raise tornado.web.HTTPError(404, f"unknown query {query}")
+        args = {k: [v.decode() for v in vs] for k, vs in self.request.arguments.items()}
+        try:
+            self.etag, body = await self.cache.get(query, args)
+        except (KeyError, IndexError, ValueError) as e:
+            raise tornado.web.HTTPError(400, f"bad arguments: {e}")
+
+        self.set_header("Content-Type", "application/json")
+        self.write(body)
+
+    def compute_etag(self):
+        return self.etag
+
+
+def make_app(source: str = ds.FEATURES_URL):
+    """Builds the tornado application serving QUERIES
+
+    Args:
+        source (str, optional): url or path of names_combined_features.csv
+
+    Returns:
+        tornado.web.Application: the api
+    """
+    cache = QueryCache(source)
+    return tornado.web.Application(
+        [(r"/(\w+)", QueryHandler, {"cache": cache})],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", default=ds.default_source())
+    parser.add_argument("--port", type=int, default=8600)
+    args = parser.parse_args()
+
+    ds.enable_copy_on_write()
+    # Load the dataset and its version before accepting requests
+    ds.dataset_version(args.source)
+    make_app(args.source).listen(args.port, address="127.0.0.1")
+    print(f"Serving on http://127.0.0.1:{args.port}")
+    tornado.ioloop.IOLoop.current().start()
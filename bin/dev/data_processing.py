@@ -3,17 +3,41 @@
 Returns:
     _type_: _description_
 """
+
 import pandas as pd
+import numpy as np
+import concurrent.futures
+import functools
 import os
 import pathlib
+import re
+import unicodedata
+
+import dev.dataset as ds
+import dev.queries as queries
+import dev.sketches as sketches
+import dev.variants as variants
+
+# characters that mark an entry as something other than a plain first name
+NON_NAME_CHARACTERS = [")", "-"]
 
 
-def get_kiez_files():
-    names_2012 = (
-        pathlib.Path(__file__) / ".." / ".." / ".." / "data" / "cleaned" / "2012"
+def get_kiez_files(year: int = 2012):
+    """File names of the cleaned csv files of a year, one per kiez
+
+    Years differ: Standesamt I only has a file from 2014 on, and files
+    backfilled by dev/extraction.py only exist for their own year.
+
+    Args:
+        year (int, optional): year of baby names
+
+    Returns:
+        list: sorted csv file names, e.g. "mitte.csv"
+    """
+    year_path = (
+        pathlib.Path(__file__) / ".." / ".." / ".." / "data" / "cleaned" / str(year)
     ).resolve()
-    year_file_names = os.listdir(names_2012)
-    return year_file_names
+    return sorted(f for f in os.listdir(year_path) if f.endswith(".csv"))
 
 
 def get_names(year: int, kiez: str):
@@ -51,18 +75,36 @@ def get_names(year: int, kiez: str):
     return names
 
 
-def get_names_all(write_csv: bool = False):
+def read_names(years=range(2012, 2023)):
+    """Concatenates the cleaned files of every kiez for the given years
+
+    Args:
+        years (iterable, optional): years to read
+
+    Returns:
+        pd.DataFrame: raw names of all kiez and years
+    """
     all_names = pd.DataFrame()
-    kiez_file_names = get_kiez_files()
-    for year in range(2012, 2023):
-        for kiez in kiez_file_names:
+    for year in years:
+        for kiez in get_kiez_files(year):
             n = get_names(year, kiez)
             all_names = pd.concat([all_names, n])
-    all_names = all_names.loc[:, ~all_names.columns.str.contains("^Unnamed")]
-    all_names = all_names.loc[~all_names.loc[:, "vorname"].str.contains("\)"), :]
-    all_names = all_names.loc[~all_names.loc[:, "vorname"].str.contains("-"), :]
+    return all_names.loc[:, ~all_names.columns.str.contains("^Unnamed")]
+
+
+def get_names_all(write_csv: bool = False):
+    all_names = read_names()
+
+    table_path = (
+        pathlib.Path(__file__) / ".." / ".." / ".." / "data" / "names_canonical.csv"
+    ).resolve()
+    name_table = (
+        pd.read_csv(table_path, keep_default_na=False) if table_path.exists() else None
+    )
+    all_names, name_table = canonicalize_names(all_names, name_table)
 
     if write_csv:
+        name_table.to_csv(table_path, index=False)
         csv_path = (
             pathlib.Path(__file__)
             / ".."
@@ -76,6 +118,199 @@ def get_names_all(write_csv: bool = False):
     return all_names
 
 
+def sketch_items(names: pd.DataFrame):
+    """Sketch keys and counts of raw names
+
+    Args:
+        names (pd.DataFrame): raw names with "vorname", "geschlecht" and "anzahl"
+
+    Returns:
+        pd.Series: counts indexed by "<case folded name>_<geschlecht>",
+            without non-names
+    """
+    row_codes, spellings = count_spellings(names)
+    keys = spellings.loc[:, "key"].where(spellings.loc[:, "valid"]).to_numpy()
+    keys = keys[row_codes]
+    keep = pd.notna(keys)
+    items = keys[keep] + "_" + names.loc[:, "geschlecht"].to_numpy()[keep]
+    return pd.Series(names.loc[:, "anzahl"].to_numpy()[keep], index=items).astype(
+        "int64"
+    )
+
+
+def sketch_names(year: int, kiez: str, k: int = 1000, width=4096, depth=4):
+    """Streams one year and kiez file into heavy-hitter sketches
+
+    Args:
+        year (int): year of baby names
+        kiez (str): berlin kiez name
+        k (int, optional): names kept by the SpaceSaving summary
+        width (int, optional): Count-Min counters per row
+        depth (int, optional): Count-Min rows
+
+    Returns:
+        tuple: SpaceSaving and CountMin of the file
+    """
+    items = sketch_items(get_names(year, kiez))
+    space_saving = sketches.SpaceSaving(k)
+    space_saving.update(items.index, items.to_numpy())
+    count_min = sketches.CountMin(width, depth)
+    count_min.update(items.index, items.to_numpy())
+    return space_saving, count_min
+
+
+def _sketch_partition(partition, k, width, depth):
+    return sketch_names(*partition, k=k, width=width, depth=depth)
+
+
+def sketch_names_all(
+    years=range(2012, 2023), k: int = 1000, width=4096, depth=4, workers=None
+):
+    """Sketches of every year and kiez, without holding all names in memory
+
+    Streaming alternative to `get_names_all` for inputs too large for one
+    table: every file is read, sketched and dropped, only the sketches are
+    kept. Merge them with `sketches.merge_sketches` for any set of years and
+    kiez.
+
+    Args:
+        years (iterable, optional): years to read
+        k (int, optional): names kept by the SpaceSaving summaries
+        width (int, optional): Count-Min counters per row
+        depth (int, optional): Count-Min rows
+        workers (int, optional): worker processes, default one per cpu
+
+    Returns:
+        dict: (year, kiez) -> (SpaceSaving, CountMin)
+    """
+    partitions = [(year, kiez[:-4]) for year in years for kiez in get_kiez_files(year)]
+    sketch = functools.partial(_sketch_partition, k=k, width=width, depth=depth)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(partitions, pool.map(sketch, partitions)))
+
+
+def is_name(vornamen: pd.Series):
+    """Flags strings that are plain first names
+
+    Args:
+        vornamen (pd.Series): candidate names
+
+    Returns:
+        pd.Series: False for empty strings and strings with NON_NAME_CHARACTERS
+    """
+    pattern = "|".join(re.escape(c) for c in NON_NAME_CHARACTERS)
+    return (vornamen.str.len() > 0) & ~vornamen.str.contains(pattern)
+
+
+def count_spellings(names: pd.DataFrame):
+    """Normalized spellings of the raw names with their summed counts
+
+    Args:
+        names (pd.DataFrame): raw names with "vorname" and "anzahl" columns
+
+    Returns:
+        np.ndarray: index into the spellings for every row
+        pd.DataFrame: "vorname" (NFC normalized, stripped), "key" (case
+            folded), "valid" (see `is_name`) and summed "anzahl" per spelling
+    """
+    raw = names.loc[:, "vorname"].astype(str).astype("category")
+    normalized = pd.Series(raw.cat.categories).map(
+        lambda s: unicodedata.normalize("NFC", s).strip()
+    )
+    spelling_codes, unique = pd.factorize(normalized)
+    row_codes = spelling_codes[raw.cat.codes.to_numpy()]
+
+    spellings = pd.Series(unique)
+    spellings = pd.DataFrame(
+        {
+            "vorname": spellings,
+            "key": spellings.str.casefold(),
+            "valid": is_name(spellings),
+            "anzahl": np.bincount(
+                row_codes, weights=names.loc[:, "anzahl"], minlength=len(spellings)
+            ),
+        }
+    )
+    return row_codes, spellings
+
+
+def name_categorical(name_ids: np.ndarray, name_table: pd.DataFrame):
+    """Categorical of display names for name ids, categories sorted by name"""
+    categories = name_table.sort_values("vorname")
+    id_to_code = np.empty(name_table.loc[:, "name_id"].max() + 1, dtype="int32")
+    id_to_code[categories.loc[:, "name_id"]] = np.arange(len(categories))
+    return pd.Categorical.from_codes(id_to_code[name_ids], categories.loc[:, "vorname"])
+
+
+def canonicalize_names(
+    names: pd.DataFrame,
+    name_table: pd.DataFrame = None,
+    spelling_counts: pd.DataFrame = None,
+):
+    """Maps every row to an entry of the table of unique names
+
+    Names are NFC normalized and stripped, spellings that only differ in case
+    share an entry, shown in their most frequent spelling. All string work
+    happens once per distinct spelling, rows are only touched through codes.
+
+    Args:
+        names (pd.DataFrame): raw names with "vorname" and "anzahl" columns
+        name_table (pd.DataFrame, optional): earlier name table, whose ids are kept
+        spelling_counts (pd.DataFrame, optional): spelling counts (see
+            `count_spellings`) to pick display spellings from instead of the
+            counts in `names`, e.g. the totals of all years when `names` only
+            holds a new year
+
+    Returns:
+        pd.DataFrame: names without non-names, with a categorical "vorname"
+            and its integer "name_id"
+        pd.DataFrame: name table with "name_id", "key" (case folded) and "vorname"
+    """
+    row_codes, spellings = count_spellings(names)
+    if spelling_counts is None:
+        spelling_counts = spellings
+
+    # most frequent spelling per key
+    display = (
+        spelling_counts.loc[spelling_counts.loc[:, "valid"], :]
+        .sort_values(["anzahl", "vorname"], ascending=[False, True], kind="stable")
+        .drop_duplicates("key")
+        .set_index("key")
+        .loc[:, "vorname"]
+    )
+
+    # keep earlier ids, append new keys in sorted order
+    if name_table is None:
+        name_table = pd.DataFrame(columns=["name_id", "key", "vorname"])
+    ids = name_table.set_index("key").loc[:, "name_id"].astype("int32")
+    new_keys = sorted(set(display.index) - set(ids.index))
+    start = ids.max() + 1 if len(ids) else 0
+    ids = pd.concat(
+        [ids, pd.Series(np.arange(start, start + len(new_keys)), index=new_keys)]
+    ).astype("int32")
+    name_table = pd.DataFrame(
+        {
+            "name_id": ids.to_numpy(),
+            "key": ids.index,
+            "vorname": display.reindex(ids.index)
+            .fillna(name_table.set_index("key").loc[:, "vorname"])
+            .to_numpy(),
+        }
+    )
+
+    # row -> spelling -> name_id, non-names have no id
+    spelling_ids = spellings.loc[:, "key"].map(ids).where(spellings.loc[:, "valid"])
+    row_ids = spelling_ids.to_numpy()[row_codes]
+    keep = ~np.isnan(row_ids)
+    names = names.loc[keep, :].copy()
+    row_ids = row_ids[keep].astype("int32")
+
+    names["vorname"] = name_categorical(row_ids, name_table)
+    names["name_id"] = row_ids
+
+    return names, name_table
+
+
 def combine_vorname_geschlecht_position(names: pd.DataFrame):
     """Creates the "vorname_" column with gender and position encoded
 
@@ -85,14 +320,19 @@ def combine_vorname_geschlecht_position(names: pd.DataFrame):
     Returns:
         pd.DataFrame: input df with an extra "vorname_" column
     """
-    # embed gender in name
-    names["vorname_"] = names.loc[:, "vorname"] + "_" + names.loc[:, "geschlecht"]
-
+    # build the label once per distinct combination, not per row
+    columns = ["vorname", "geschlecht"]
     if "position" in names.columns:
         # add positional name
-        names["vorname_"] = (
-            names.loc[:, "vorname_"] + "_" + names.loc[:, "position"].astype(str)
-        )
+        columns.append("position")
+
+    codes, combinations = pd.MultiIndex.from_frame(names.loc[:, columns]).factorize()
+    labels = combinations.get_level_values(0).astype(str)
+    for level in range(1, len(columns)):
+        labels = labels + "_" + combinations.get_level_values(level).astype(str)
+
+    # embed gender in name
+    names["vorname_"] = pd.Categorical.from_codes(codes, labels)
 
     return names
 
@@ -110,7 +350,7 @@ def add_gender_scale_unisex_score(names: pd.DataFrame):
         pd.DataFrame: input df with "unisex_score" and "gender_scale" columns
     """
     # First, calculate the total 'anzahl' for each name and gender
-    totals = names.groupby(["vorname", "geschlecht"])["anzahl"].sum()
+    totals = names.groupby(["vorname", "geschlecht"], observed=True)["anzahl"].sum()
 
     unisex_scores = {}
     gender_scale = {}
@@ -148,6 +388,25 @@ def add_gender_scale_unisex_score(names: pd.DataFrame):
     return names
 
 
+def add_variant_clusters(names: pd.DataFrame):
+    """Adds the spelling-variant cluster of every name
+
+    Args:
+        names (pd.DataFrame): canonicalized names with "name_id" and
+            "gender_scale"
+
+    Returns:
+        pd.DataFrame: input df with a "cluster_id" column, the smallest
+            name_id of the name's cluster (see dev/variants.py)
+    """
+    totals = names.groupby(["name_id", "vorname"], observed=True).agg(
+        anzahl=("anzahl", "sum"), gender_scale=("gender_scale", "first")
+    )
+    clusters = variants.variant_clusters(totals.reset_index())
+    names["cluster_id"] = clusters.reindex(names.loc[:, "name_id"]).to_numpy()
+    return names
+
+
 def add_rank(names: pd.DataFrame):
     return names
 
@@ -155,6 +414,7 @@ def add_rank(names: pd.DataFrame):
 def add_features(names: pd.DataFrame, write_csv: bool = False):
     names = combine_vorname_geschlecht_position(names)
     names = add_gender_scale_unisex_score(names)
+    names = add_variant_clusters(names)
 
     if write_csv:
         csv_path = (
@@ -166,5 +426,12 @@ def add_features(names: pd.DataFrame, write_csv: bool = False):
             / "names_combined_features.csv"
         ).resolve()
         names.to_csv(csv_path)
+        ds.write_arrow(
+            queries.name_profiles(names), csv_path.with_name("names_profiles.arrow")
+        )
+        ds.write_arrow(names, ds.arrow_source(csv_path))
+        queries.name_diversity(names).to_csv(
+            csv_path.with_name("names_diversity.csv"), index=False
+        )
 
     return names
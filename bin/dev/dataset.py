@@ -0,0 +1,329 @@
+"""Process-shared access to the combined baby names dataset
+
+Streamlit runs every session in the same process, so the dataset is read
+once and kept in a module-level registry. Sessions never receive the shared
+frame itself, only copy-on-write views of it: filtering or adding columns in
+a session copies just the touched data and can never alter the shared rows.
+Copy-on-write is a process-wide pandas option, so importing this module
+doesn't change it. Entry points sharing the dataset turn it on at startup
+with `enable_copy_on_write`, the loaders refuse to share without it.
+
+Several worker processes share one copy through an Arrow IPC (Feather v2)
+file written next to the csv, e.g. for an existing csv from the bin folder:
+    python -m dev.dataset ../data/names_combined_features.csv
+With BABYNAMES_SOURCE pointing at the .arrow file, every process memory-maps
+it and the frame's columns point into the mapping, so the operating system
+keeps a single copy in its page cache. The per-name profiles are written and
+mapped the same way (names_profiles.arrow). `write_arrow` swaps in a new
+version atomically, processes pick it up at their next `load_names` call.
+"""
+
+import hashlib
+import os
+import pathlib
+import re
+import sys
+import threading
+import urllib.error
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import dev.queries as queries
+
+FEATURES_URL = "https://raw.githubusercontent.com/JustinZarb/babyNamesBerlin/master/data/names_combined_features.csv"
+
+CATEGORICAL_COLUMNS = {
+    "vorname": "category",
+    "vorname_": "category",
+    "geschlecht": "category",
+    "kiez": "category",
+    "gender_category": "category",
+}
+
+# numpy buffers of categorical, datetime and nullable extension arrays
+_EXTENSION_BUFFERS = ("_ndarray", "_data", "_mask")
+
+_lock = threading.Lock()
+_shared = {}
+# file identity of every memory-mapped source when it was read
+_signatures = {}
+
+
+def enable_copy_on_write():
+    """Turns on pandas copy-on-write for the whole process
+
+    Views then share memory with their parent until one of them is written
+    to. This changes the semantics of chained assignment for all code in the
+    process, so only entry points call it, before their first `load_names`.
+    """
+    pd.set_option("mode.copy_on_write", True)
+
+
+def _require_copy_on_write():
+    if not pd.get_option("mode.copy_on_write"):
+        raise RuntimeError(
+            "sharing the dataset needs copy-on-write, call "
+            "dataset.enable_copy_on_write() at startup"
+        )
+
+
+def default_source():
+    """Location of the dataset, BABYNAMES_SOURCE (e.g. a local path) overrides the url
+
+    Returns:
+        str: url or path of names_combined_features.csv
+    """
+    return os.environ.get("BABYNAMES_SOURCE", FEATURES_URL)
+
+
+def arrow_source(source: str):
+    """Location of the Arrow IPC file written next to a csv"""
+    return re.sub(r"\.csv$", ".arrow", str(source))
+
+
+def _is_arrow(source: str):
+    return str(source).endswith(".arrow")
+
+
+def write_arrow(names: pd.DataFrame, path):
+    """Writes a table as an uncompressed Arrow IPC file, replacing it atomically
+
+    The file is written next to the target and renamed over it, so a process
+    opening the path sees either the old or the new version in full.
+    Processes that mapped the old file keep reading it until they reload.
+    One record batch and no compression let readers map every column
+    without copying it.
+
+    Args:
+        names (pd.DataFrame): combined names dataset or a table derived from
+            it, the index is not written
+        path (str | pathlib.Path): local path of the .arrow file
+    """
+    path = pathlib.Path(path)
+    names = names.loc[:, ~names.columns.str.contains("^Unnamed")]
+    names = names.astype(
+        {column: "category" for column in CATEGORICAL_COLUMNS if column in names}
+    )
+    table = pa.Table.from_pandas(names, preserve_index=False)
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    feather.write_feather(
+        table, temporary, compression="uncompressed", chunksize=max(len(names), 1)
+    )
+    os.replace(temporary, path)
+
+
+def _read_arrow(path):
+    """Memory-maps an Arrow IPC file, its columns are read-only views of the file"""
+    table = feather.read_table(path, memory_map=True)
+    # one block per column, so pandas doesn't copy them into 2d blocks
+    return table.to_pandas(split_blocks=True)
+
+
+def _read_names(source: str):
+    """Reads the combined features csv and drops the written index column
+
+    Repeated strings are read as categoricals, so filters and groupbys work on
+    integer codes. An .arrow source is memory-mapped instead: its columns are
+    read-only views of the mapped file.
+
+    Args:
+        source (str): url or path of names_combined_features.csv, or local
+            path of its .arrow file
+
+    Returns:
+        pd.DataFrame: the dataset as it is shared between sessions
+    """
+    if _is_arrow(source):
+        return _read_arrow(source)
+    names = pd.read_csv(source, dtype=CATEGORICAL_COLUMNS)
+    names = names.loc[:, ~names.columns.str.contains("^Unnamed")]
+    return names
+
+
+def _freeze(names: pd.DataFrame):
+    """Marks the numeric blocks and categorical codes of the shared frame read-only
+
+    Any code path that reaches the raw arrays (e.g. `.values` or `.array`)
+    and tries to write to them raises instead of silently changing every
+    session's data. Object blocks stay writeable: pandas' string comparisons
+    reject read-only buffers, and copy-on-write already keeps sessions from
+    altering them.
+
+    Args:
+        names (pd.DataFrame): the shared frame
+
+    Returns:
+        pd.DataFrame: the same frame, with read-only blocks
+    """
+    for block in names._mgr.blocks:
+        # extension arrays keep their data in numpy arrays, e.g. the codes of
+        # a categorical (`.codes` itself is a read-only view of them)
+        arrays = [block.values] + [
+            getattr(block.values, name, None) for name in _EXTENSION_BUFFERS
+        ]
+        for values in arrays:
+            if isinstance(values, np.ndarray) and values.dtype != object:
+                values.flags.writeable = False
+    return names
+
+
+def _check_swap(source: str):
+    """Drops everything shared for a source whose .arrow file was replaced
+
+    Called with `_lock` held. Costs one stat call.
+    """
+    if not _is_arrow(source):
+        return
+    stat = os.stat(source)
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _signatures.get(source) != signature:
+        for key in [
+            source,
+            ("version", source),
+            ("diversity", source),
+            ("profiles", source),
+        ]:
+            _shared.pop(key, None)
+        _signatures[source] = signature
+
+
+def load_names(source: str = FEATURES_URL):
+    """Returns a view of the shared names dataset
+
+    The first call per source reads the data, later calls (from any session
+    or thread) reuse it without copying. For an .arrow source, a file swapped
+    in by `write_arrow` is mapped at the next call, sessions holding views of
+    the old version keep them.
+
+    Args:
+        source (str, optional): url or path of names_combined_features.csv,
+            or local path of its .arrow file
+
+    Returns:
+        pd.DataFrame: copy-on-write view of the shared dataset
+    """
+    _require_copy_on_write()
+    with _lock:
+        _check_swap(source)
+        if source not in _shared:
+            _shared[source] = _freeze(_read_names(source))
+    return _shared[source].copy(deep=False)
+
+
+def dataset_version(source: str = FEATURES_URL):
+    """Short content hash of the shared dataset, the same for any copy of it
+
+    Hashes the loaded rows rather than the file, so a local copy and the url
+    have the same version. Computed once per source.
+
+    Args:
+        source (str, optional): url or path of names_combined_features.csv
+
+    Returns:
+        str: 12 hex digits
+    """
+    key = ("version", source)
+    with _lock:
+        _check_swap(source)
+        if key in _shared:
+            return _shared[key]
+    names = load_names(source)
+    digest = hashlib.sha1(",".join(names.columns).encode())
+    digest.update(pd.util.hash_pandas_object(names, index=False).to_numpy().tobytes())
+    with _lock:
+        return _shared.setdefault(key, digest.hexdigest()[:12])
+
+
+def diversity_source(source: str):
+    """Location of the diversity table written next to names_combined_features.csv"""
+    return re.sub(
+        r"names_combined_features\.(csv|arrow)$", "names_diversity.csv", source
+    )
+
+
+def load_diversity(source: str = FEATURES_URL):
+    """Returns the name diversity per kiez, year and gender
+
+    Reads the persisted table next to the dataset, or computes it from the
+    shared dataset where there is none. Either way once per source.
+
+    Args:
+        source (str, optional): url or path of names_combined_features.csv
+
+    Returns:
+        pd.DataFrame: see `queries.name_diversity`
+    """
+    _require_copy_on_write()
+    key = ("diversity", source)
+    with _lock:
+        _check_swap(source)
+        if key in _shared:
+            return _shared[key].copy(deep=False)
+    diversity = None
+    if diversity_source(source) != source:
+        try:
+            diversity = pd.read_csv(diversity_source(source))
+        except (FileNotFoundError, urllib.error.URLError):
+            pass
+    if diversity is None:
+        diversity = queries.name_diversity(load_names(source))
+    with _lock:
+        _shared.setdefault(key, _freeze(diversity))
+        return _shared[key].copy(deep=False)
+
+
+def profiles_source(source: str):
+    """Location of the name profiles written next to names_combined_features.csv"""
+    return re.sub(
+        r"names_combined_features\.(csv|arrow)$", "names_profiles.arrow", source
+    )
+
+
+def load_profiles(source: str = FEATURES_URL):
+    """Returns the name profiles indexed by name, see `queries.name_profiles`
+
+    Memory-maps the profiles file next to a local dataset, or computes the
+    profiles from the shared dataset where there is none. Either way once
+    per source, so looking up a name is a single indexed row read
+    (`queries.name_profile`) whatever the size of the dataset.
+
+    Args:
+        source (str, optional): url or path of names_combined_features.csv,
+            or local path of its .arrow file
+
+    Returns:
+        pd.DataFrame: copy-on-write view of the shared profiles
+    """
+    _require_copy_on_write()
+    key = ("profiles", source)
+    with _lock:
+        _check_swap(source)
+        if key in _shared:
+            return _shared[key].copy(deep=False)
+    path = profiles_source(source)
+    if path != source and os.path.exists(path):
+        profiles = _read_arrow(path)
+    else:
+        profiles = queries.name_profiles(load_names(source))
+    profiles = profiles.set_index("vorname")
+    with _lock:
+        _shared.setdefault(key, _freeze(profiles))
+        return _shared[key].copy(deep=False)
+
+
+def clear_cache():
+    """Drops all shared datasets, the next `load_names` call reads them again"""
+    with _lock:
+        _shared.clear()
+        _signatures.clear()
+
+
+if __name__ == "__main__":
+    names = _read_names(sys.argv[1])
+    # profiles first, a process noticing the new dataset then finds them too
+    if profiles_source(sys.argv[1]) != sys.argv[1]:
+        write_arrow(queries.name_profiles(names), profiles_source(sys.argv[1]))
+    write_arrow(names, arrow_source(sys.argv[1]))
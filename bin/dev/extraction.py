@@ -0,0 +1,333 @@
+"""Name tables extracted from the PDF and DOCX sources
+
+Run from the bin folder:
+    python -m dev.extraction --backfill
+
+Parses the name tables in data/source/<year>/*.pdf|*.docx in parallel,
+caches every extraction under
+data/extracted/<sha256 of the file>-v<EXTRACTION_VERSION>.csv and compares
+the counts with the matching csv in data/cleaned. With --backfill,
+district-years that only exist as a document get a cleaned csv written from
+the extraction. Unchanged documents are read from the cache, so reruns only
+hash the files. Documents without a readable table (e.g. St.Amt I 2019, a
+DOCX holding only a scanned image) are reported as unreadable, they need OCR.
+
+`read_names` in dev/data_processing.py reads every csv of a year's folder, so
+backfilled files are part of the next build.
+
+Reading PDFs needs pdfplumber, DOCX files are read with the standard library.
+"""
+
+import concurrent.futures
+import hashlib
+import pathlib
+import re
+import zipfile
+from xml.etree import ElementTree
+
+import pandas as pd
+import typer
+
+DATA_PATH = (pathlib.Path(__file__) / ".." / ".." / ".." / "data").resolve()
+SOURCE_PATH = DATA_PATH / "source"
+CLEANED_PATH = DATA_PATH / "cleaned"
+CACHE_PATH = DATA_PATH / "extracted"
+DOCUMENT_SUFFIXES = (".pdf", ".docx")
+# part of the cache key, increase it when a parser changes its output
+EXTRACTION_VERSION = 2
+COLUMNS = ["vorname", "anzahl", "geschlecht", "position"]
+
+# file name patterns per cleaned csv name, checked on the lower cased file name
+# with umlauts spelled out (see `_normalize_file_name`)
+KIEZ_PATTERNS = {
+    "charlottenburg-wilmersdorf": ["charlottenburg-wilmersdorf", "c.-w."],
+    "friedrichshain-kreuzberg": ["friedrichshain-kreuzberg", "f.-k."],
+    "lichtenberg": ["lichtenberg", "libg"],
+    "marzahn-hellersdorf": ["marzahn-hellersdorf", "m.-h."],
+    "mitte": ["mitte"],
+    "neukoelln": ["neukoelln", "nkn"],
+    "pankow": ["pankow"],
+    "reinickendorf": ["reinickendorf", "rdf"],
+    "spandau": ["spandau"],
+    "steglitz-zehlendorf": ["steglitz-zehlendorf", "s.-z."],
+    "tempelhof-schoeneberg": ["tempelhof-schoeneberg", "t.-s."],
+    "treptow-koepenick": ["treptow-koepenick", "t.-k."],
+    "standesamt_i": ["standesamt_i", "standesamt-i", "st.amt i ", "i in berlin"],
+}
+
+app = typer.Typer()
+
+
+def _normalize_file_name(name: str):
+    name = name.lower()
+    for umlaut, spelled in [("ö", "oe"), ("ü", "ue"), ("ä", "ae"), ("ß", "ss")]:
+        name = name.replace(umlaut, spelled)
+    return name
+
+
+def document_kiez(path: pathlib.Path):
+    """Cleaned csv name (without .csv) a source document belongs to
+
+    Args:
+        path (pathlib.Path): source document
+
+    Returns:
+        str: kiez name, None if the file name matches no kiez
+    """
+    name = _normalize_file_name(path.name)
+    for kiez, patterns in KIEZ_PATTERNS.items():
+        if any(pattern in name for pattern in patterns):
+            return kiez
+    return None
+
+
+def file_hash(path: pathlib.Path):
+    """sha256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _section_position(text: str, position):
+    """Name position announced by a section title, else the current one
+
+    "Rangliste der 2. Vornamen" starts the table of second names, older
+    documents have a single "Häufigkeit der vergebenen Vornamen" table.
+    """
+    match = re.search(r"Rangliste der (\d+)\. Vornamen", text)
+    if match:
+        return int(match.group(1))
+    if "Häufigkeit der vergebenen Vornamen" in text:
+        return None
+    return position
+
+
+def _parse_side(tokens: list, geschlecht: str, position):
+    """Turns the tokens of one side of a table row into a record
+
+    Args:
+        tokens (list): name tokens followed by the count
+        geschlecht (str): "w" for the girls' side, "m" for the boys'
+
+    Returns:
+        dict: record with COLUMNS, None if the tokens hold no name and count
+    """
+    if len(tokens) < 2:
+        return None
+    count = tokens[-1].replace(".", "")
+    if not count.isdigit():
+        return None
+    return {
+        "vorname": " ".join(tokens[:-1]),
+        "anzahl": int(count),
+        "geschlecht": geschlecht,
+        "position": position,
+    }
+
+
+def extract_pdf(path: pathlib.Path):
+    """Reads the name tables of a PDF source document
+
+    Rows hold a rank, a girl's name and count and a boy's name and count.
+    Either side can be empty, so words are assigned to a side by their
+    position relative to the "Knaben" column header.
+
+    Args:
+        path (pathlib.Path): source document
+
+    Returns:
+        pd.DataFrame: COLUMNS, position is None for documents without positions
+    """
+    import pdfplumber
+
+    records = []
+    position = None
+    boys_x0 = None
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages:
+            lines = {}
+            for word in page.extract_words():
+                lines.setdefault(round(word["top"]), []).append(word)
+
+            for top in sorted(lines):
+                words = sorted(lines[top], key=lambda w: w["x0"])
+                text = " ".join(w["text"] for w in words)
+                position = _section_position(text, position)
+                if words[0]["text"] == "Rang":
+                    boys_x0 = next(w["x0"] for w in words if w["text"] == "Knaben")
+                    continue
+                if boys_x0 is None or not words[0]["text"].isdigit():
+                    continue
+
+                # the boys' names start a little left of their column header
+                girls = [w["text"] for w in words[1:] if w["x0"] < boys_x0 - 20]
+                boys = [w["text"] for w in words[1:] if w["x0"] >= boys_x0 - 20]
+                for tokens, geschlecht in [(girls, "w"), (boys, "m")]:
+                    record = _parse_side(tokens, geschlecht, position)
+                    if record:
+                        records.append(record)
+
+    return pd.DataFrame(records, columns=COLUMNS)
+
+
+def extract_docx(path: pathlib.Path):
+    """Reads the name tables of a DOCX source document
+
+    Tables have the same columns as in the PDF documents, section titles are
+    paragraphs between them.
+
+    Args:
+        path (pathlib.Path): source document
+
+    Returns:
+        pd.DataFrame: COLUMNS, position is None for documents without positions
+    """
+    ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
+    with zipfile.ZipFile(path) as docx:
+        body = ElementTree.fromstring(docx.read("word/document.xml")).find("w:body", ns)
+
+    def text_of(element):
+        return "".join(t.text or "" for t in element.iterfind(".//w:t", ns)).strip()
+
+    records = []
+    position = None
+    for element in body:
+        if element.tag == f"{{{ns['w']}}}p":
+            position = _section_position(text_of(element), position)
+        elif element.tag == f"{{{ns['w']}}}tbl":
+            for row in element.iterfind("w:tr", ns):
+                cells = [text_of(cell) for cell in row.iterfind("w:tc", ns)]
+                if len(cells) < 5 or not cells[0].isdigit():
+                    continue
+                for tokens, geschlecht in [(cells[1:3], "w"), (cells[3:5], "m")]:
+                    record = _parse_side([t for t in tokens if t], geschlecht, position)
+                    if record:
+                        records.append(record)
+
+    return pd.DataFrame(records, columns=COLUMNS)
+
+
+def extract_document(path: pathlib.Path, cache_path: pathlib.Path = CACHE_PATH):
+    """Extracts a document, or reads the cached extraction of identical content
+
+    Args:
+        path (pathlib.Path): source document
+        cache_path (pathlib.Path, optional): folder of cached extractions
+
+    Returns:
+        pd.DataFrame: COLUMNS
+    """
+    cached = cache_path / f"{file_hash(path)}-v{EXTRACTION_VERSION}.csv"
+    if cached.exists():
+        return pd.read_csv(cached)
+
+    if path.suffix == ".pdf":
+        names = extract_pdf(path)
+    else:
+        names = extract_docx(path)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    names.to_csv(cached, index=False)
+    return names
+
+
+def compare_counts(extracted: pd.DataFrame, cleaned: pd.DataFrame):
+    """Counts of a document next to those of the cleaned csv
+
+    Args:
+        extracted (pd.DataFrame): extraction of a source document
+        cleaned (pd.DataFrame): the matching cleaned csv
+
+    Returns:
+        pd.DataFrame: "vorname", "geschlecht", "position" with the count of
+            each source ("document", "csv"), NaN where a source lacks the name
+    """
+    keys = ["vorname", "geschlecht", "position"]
+    frames = []
+    for names in [extracted, cleaned]:
+        names = names.copy()
+        if "position" not in names.columns:
+            names["position"] = 1
+        names["position"] = names["position"].fillna(1).astype(int)
+        frames.append(names.groupby(keys)["anzahl"].sum())
+
+    return pd.concat(frames, axis=1, keys=["document", "csv"]).reset_index()
+
+
+def summarize_counts(counts: pd.DataFrame):
+    """Agreement between a document and its csv
+
+    Many documents only list the most frequent names and the cleaned csv files
+    have non-names removed, so names missing on one side are counted apart
+    from names whose counts differ.
+
+    Args:
+        counts (pd.DataFrame): output of `compare_counts`
+
+    Returns:
+        dict: "matching", "different", "document_only" and "csv_only" names
+    """
+    in_document = counts["document"].notna()
+    in_csv = counts["csv"].notna()
+    both = in_document & in_csv
+    return {
+        "matching": int((both & (counts["document"] == counts["csv"])).sum()),
+        "different": int((both & (counts["document"] != counts["csv"])).sum()),
+        "document_only": int((in_document & ~in_csv).sum()),
+        "csv_only": int((in_csv & ~in_document).sum()),
+    }
+
+
+def to_cleaned_csv(names: pd.DataFrame, path: pathlib.Path):
+    """Writes an extraction in the format of data/cleaned"""
+    if names["position"].isna().all():
+        names = names.drop("position", axis=1)
+    else:
+        names = names.astype({"position": int})
+    path.parent.mkdir(parents=True, exist_ok=True)
+    names.to_csv(path, index=False)
+
+
+@app.command()
+def extract(
+    source: pathlib.Path = typer.Option(SOURCE_PATH, help="Source documents"),
+    cleaned: pathlib.Path = typer.Option(CLEANED_PATH, help="Cleaned csv files"),
+    workers: int = typer.Option(None, help="Worker processes, default one per cpu"),
+    backfill: bool = typer.Option(False, help="Write csv files missing in cleaned"),
+):
+    """Extract the source documents and compare them with the cleaned csv files"""
+    documents = {}
+    for path in sorted(source.glob("*/*")):
+        kiez = document_kiez(path)
+        if path.suffix.lower() in DOCUMENT_SUFFIXES and kiez:
+            documents.setdefault((int(path.parent.name), kiez), path)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        extractions = dict(
+            zip(documents, pool.map(extract_document, documents.values()))
+        )
+
+    rows = []
+    for (year, kiez), names in sorted(extractions.items()):
+        row = {"jahr": year, "kiez": kiez, "names": len(names)}
+        csv_path = cleaned / str(year) / f"{kiez}.csv"
+        if names.empty:
+            # no table in the document, e.g. a scanned image
+            row["unreadable"] = True
+        elif csv_path.exists():
+            row.update(summarize_counts(compare_counts(names, pd.read_csv(csv_path))))
+        elif backfill:
+            to_cleaned_csv(names, csv_path)
+            row["backfilled"] = True
+        rows.append(row)
+
+    report = pd.DataFrame(rows)
+    for column in ["matching", "different", "document_only", "csv_only"]:
+        if column in report.columns:
+            report[column] = report[column].astype("Int64")
+    typer.echo(report.to_string(index=False, na_rep=""))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,374 @@
+"""Running aggregates behind the name features, for appending a year
+
+Run from the bin folder:
+    python -m dev.feature_state rebuild
+    python -m dev.feature_state append 2023
+    python -m dev.feature_state verify --year 2022
+
+The state holds per (name_id, geschlecht, position) the total count, first
+and last year and the peak year with its count, plus the total count of every
+spelling (which decides a name's display spelling). Appending a year folds its
+partition into these aggregates and recomputes the gender scores only for the
+names in the new year, instead of rerunning `add_features` over all years.
+Variant clusters are recomputed from the per-name totals.
+`verify` appends the last year to the features of the earlier years and
+checks the result against a full rebuild.
+"""
+
+import pathlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+import typer
+
+import dev.data_processing as dp
+import dev.dataset as ds
+import dev.queries as queries
+import dev.variants as variants
+
+DATA_PATH = (pathlib.Path(__file__) / ".." / ".." / ".." / "data").resolve()
+FEATURES_CSV = DATA_PATH / "names_combined_features.csv"
+FEATURES_ARROW = DATA_PATH / "names_combined_features.arrow"
+PROFILES_ARROW = DATA_PATH / "names_profiles.arrow"
+DIVERSITY_CSV = DATA_PATH / "names_diversity.csv"
+NAME_TABLE_CSV = DATA_PATH / "names_canonical.csv"
+STATE_PATH = DATA_PATH / "feature_state"
+KEYS = ["name_id", "geschlecht", "position"]
+
+app = typer.Typer()
+
+
+def name_aggregates(names: pd.DataFrame):
+    """Totals, first, last and peak year per name, gender and position
+
+    Args:
+        names (pd.DataFrame): canonicalized names with "name_id"
+
+    Returns:
+        pd.DataFrame: KEYS with "anzahl", "first_year", "last_year",
+            "peak_year" and "peak_anzahl" (the earliest year of the peak)
+    """
+    yearly = (
+        names.groupby(KEYS + ["jahr"], observed=True)["anzahl"]
+        .sum()
+        .reset_index()
+        .astype({"geschlecht": str, "anzahl": "int64"})
+    )
+    peaks = (
+        yearly.sort_values(["anzahl", "jahr"], ascending=[False, True], kind="stable")
+        .drop_duplicates(KEYS)
+        .set_index(KEYS)
+        .rename(columns={"jahr": "peak_year", "anzahl": "peak_anzahl"})
+    )
+    aggregates = yearly.groupby(KEYS).agg(
+        anzahl=("anzahl", "sum"),
+        first_year=("jahr", "min"),
+        last_year=("jahr", "max"),
+    )
+    return aggregates.join(peaks).reset_index()
+
+
+def spelling_totals(names: pd.DataFrame):
+    """Summed counts per normalized spelling of raw names, see `count_spellings`"""
+    _, spellings = dp.count_spellings(names)
+    return spellings
+
+
+def build_state(raw: pd.DataFrame, names: pd.DataFrame):
+    """State of a full build
+
+    Args:
+        raw (pd.DataFrame): raw names as read by `read_names`
+        names (pd.DataFrame): the same names canonicalized
+
+    Returns:
+        dict: "aggregates" and "spellings" frames
+    """
+    return {"aggregates": name_aggregates(names), "spellings": spelling_totals(raw)}
+
+
+def save_state(state: dict, path: pathlib.Path = STATE_PATH):
+    path.mkdir(parents=True, exist_ok=True)
+    for name, frame in state.items():
+        frame.to_csv(path / f"{name}.csv", index=False)
+
+
+def load_state(path: pathlib.Path = STATE_PATH):
+    return {
+        name: pd.read_csv(path / f"{name}.csv", keep_default_na=False)
+        for name in ["aggregates", "spellings"]
+    }
+
+
+def read_features(path: pathlib.Path = FEATURES_CSV):
+    """Reads the features csv as `append` does"""
+    return pd.read_csv(path, index_col=0, dtype=ds.CATEGORICAL_COLUMNS)
+
+
+def read_name_table(path: pathlib.Path = NAME_TABLE_CSV):
+    # names like "Na" must not become NaN
+    return pd.read_csv(path, keep_default_na=False)
+
+
+def fold_aggregates(aggregates: pd.DataFrame, partition: pd.DataFrame):
+    """Adds the aggregates of a new year's partition
+
+    Args:
+        aggregates (pd.DataFrame): output of `name_aggregates`
+        partition (pd.DataFrame): canonicalized names of years after the
+            aggregated ones
+
+    Returns:
+        pd.DataFrame: the aggregates of both
+    """
+    new = name_aggregates(partition).set_index(KEYS)
+    aggregates = aggregates.set_index(KEYS)
+    old = aggregates.reindex(new.index)
+    seen = old.loc[:, "anzahl"].notna()
+    later_peak = ~seen | (new.loc[:, "peak_anzahl"] > old.loc[:, "peak_anzahl"])
+
+    new.loc[seen, "anzahl"] += old.loc[seen, "anzahl"].astype(int)
+    new.loc[seen, "first_year"] = old.loc[seen, "first_year"].astype(int)
+    for column in ["peak_year", "peak_anzahl"]:
+        new.loc[~later_peak, column] = old.loc[~later_peak, column].astype(int)
+
+    unchanged = aggregates.loc[~aggregates.index.isin(new.index), :]
+    return pd.concat([unchanged, new]).sort_index().reset_index()
+
+
+def gender_scores(aggregates: pd.DataFrame, name_ids=None):
+    """Unisex score and gender scale per name, as in `add_gender_scale_unisex_score`
+
+    Args:
+        aggregates (pd.DataFrame): output of `name_aggregates`
+        name_ids (list, optional): names to score, all if None
+
+    Returns:
+        pd.DataFrame: "unisex_score" and "gender_scale" indexed by name_id
+    """
+    if name_ids is not None:
+        aggregates = aggregates.loc[aggregates.loc[:, "name_id"].isin(name_ids), :]
+    totals = (
+        aggregates.groupby(["name_id", "geschlecht"])["anzahl"]
+        .sum()
+        .unstack("geschlecht")
+        .reindex(columns=["m", "w"])
+        .fillna(0)
+    )
+    m, w = totals.loc[:, "m"], totals.loc[:, "w"]
+    return pd.DataFrame(
+        {
+            "unisex_score": (np.minimum(m, w) / np.maximum(m, w)).astype("float16"),
+            "gender_scale": (w / (m + w)).astype("float16"),
+        }
+    )
+
+
+def _relabel(features: pd.DataFrame, name_table: pd.DataFrame):
+    """Points the categorical name columns at the current display spellings"""
+    features["vorname"] = dp.name_categorical(
+        features.loc[:, "name_id"].to_numpy(), name_table
+    )
+    # "vorname_" labels start with the display spelling, rename changed ones
+    labels = features.loc[:, "vorname_"].cat.categories.to_series()
+    parts = labels.str.rsplit("_", n=2, expand=True)
+    display = (
+        name_table.set_index("key")
+        .loc[:, "vorname"]
+        .reindex(parts.loc[:, 0].str.casefold())
+        .to_numpy()
+    )
+    parts[0] = display
+    renamed = parts.astype(str).agg("_".join, axis=1)
+    if (renamed != labels).any():
+        features["vorname_"] = features.loc[:, "vorname_"].cat.rename_categories(
+            renamed.to_numpy()
+        )
+    return features
+
+
+def append_year(
+    features: pd.DataFrame,
+    state: dict,
+    name_table: pd.DataFrame,
+    partition: pd.DataFrame,
+):
+    """Adds a new year to the features without recomputing the earlier years
+
+    Args:
+        features (pd.DataFrame): output of `add_features` for the earlier years
+        state (dict): state matching `features`
+        name_table (pd.DataFrame): name table matching `features`
+        partition (pd.DataFrame): raw names of the new year, as read by `read_names`
+
+    Returns:
+        pd.DataFrame: features of all years
+        dict: updated state
+        pd.DataFrame: updated name table
+    """
+    last_year = state["aggregates"].loc[:, "last_year"].max()
+    if partition.loc[:, "jahr"].min() <= last_year:
+        raise ValueError(f"years up to {last_year} are already in the state")
+
+    spellings = (
+        pd.concat([state["spellings"], spelling_totals(partition)])
+        .groupby(["vorname", "key", "valid"], as_index=False, sort=False)["anzahl"]
+        .sum()
+    )
+    partition, name_table = dp.canonicalize_names(partition, name_table, spellings)
+    aggregates = fold_aggregates(state["aggregates"], partition)
+
+    partition = dp.combine_vorname_geschlecht_position(partition)
+    vorname_ = pd.api.types.union_categoricals(
+        [features.loc[:, "vorname_"], partition.loc[:, "vorname_"]]
+    )
+    # codes by label, a csv read sorts the categories alphabetically
+    category_codes = np.concatenate(
+        [
+            pd.Categorical(
+                features.loc[:, "gender_category"], categories=queries.GENDER_LABELS
+            ).codes,
+            np.full(len(partition), -1),
+        ]
+    )
+    columns = features.columns
+    features = pd.concat([features, partition.loc[:, partition.columns[:-1]]])
+    features["vorname_"] = vorname_
+    features = _relabel(features.loc[:, columns], name_table)
+
+    # only names of the new year change their scores
+    affected = partition.loc[:, "name_id"].unique()
+    scores = gender_scores(aggregates, affected)
+    categories = pd.cut(
+        scores.loc[:, "gender_scale"],
+        bins=queries.GENDER_BINS,
+        labels=queries.GENDER_LABELS,
+    )
+    rows = features.loc[:, "name_id"].isin(affected).to_numpy()
+    ids = features.loc[rows, "name_id"]
+    for column in ["unisex_score", "gender_scale"]:
+        values = features.loc[:, column].to_numpy(
+            dtype=scores.loc[:, column].dtype, copy=True
+        )
+        values[rows] = scores.loc[ids, column].to_numpy()
+        features[column] = values
+    category_codes[rows] = categories.cat.codes.loc[ids].to_numpy()
+    features["gender_category"] = pd.Categorical.from_codes(
+        category_codes, dtype=categories.dtype
+    )
+
+    # new names can join or bridge clusters of earlier names
+    totals = aggregates.groupby("name_id", as_index=False)["anzahl"].sum()
+    totals["vorname"] = totals.loc[:, "name_id"].map(
+        name_table.set_index("name_id").loc[:, "vorname"]
+    )
+    totals["gender_scale"] = totals.loc[:, "name_id"].map(
+        features.groupby("name_id")["gender_scale"].first()
+    )
+    clusters = variants.variant_clusters(totals)
+    features["cluster_id"] = clusters.reindex(features.loc[:, "name_id"]).to_numpy()
+
+    return features, {"aggregates": aggregates, "spellings": spellings}, name_table
+
+
+def full_build(raw: pd.DataFrame, name_table: pd.DataFrame = None):
+    """Features, state and name table computed from scratch
+
+    Args:
+        raw (pd.DataFrame): raw names as read by `read_names`
+        name_table (pd.DataFrame, optional): earlier name table, whose ids are kept
+
+    Returns:
+        pd.DataFrame: features
+        dict: state
+        pd.DataFrame: name table
+    """
+    names, name_table = dp.canonicalize_names(raw, name_table)
+    state = build_state(raw, names)
+    return dp.add_features(names), state, name_table
+
+
+def _round_trip(features: pd.DataFrame, folder: str):
+    path = pathlib.Path(folder) / FEATURES_CSV.name
+    features.to_csv(path)
+    return read_features(path)
+
+
+def verify_append(year: int):
+    """Checks appending `year` against rebuilding all years up to it
+
+    The base features go through the csv as in the `append` command, and
+    both results are compared as they are written to it.
+
+    Args:
+        year (int): year to append, the earlier years from 2012 are the base
+
+    Raises:
+        AssertionError: if features, state or name table differ
+    """
+    base_raw = dp.read_names(range(2012, year))
+    features, state, name_table = full_build(base_raw)
+    with tempfile.TemporaryDirectory() as folder:
+        features = _round_trip(features, folder)
+        appended = append_year(features, state, name_table, dp.read_names([year]))
+        rebuilt = full_build(pd.concat([base_raw, dp.read_names([year])]), name_table)
+        features = _round_trip(appended[0], folder)
+        rebuilt_features = _round_trip(rebuilt[0], folder)
+    for column in ["vorname_"]:
+        features[column] = features.loc[:, column].astype(str)
+        rebuilt_features[column] = rebuilt_features.loc[:, column].astype(str)
+    pd.testing.assert_frame_equal(features, rebuilt_features)
+    for name in ["aggregates", "spellings"]:
+        pd.testing.assert_frame_equal(
+            _sorted(appended[1][name]), _sorted(rebuilt[1][name])
+        )
+    pd.testing.assert_frame_equal(appended[2], rebuilt[2])
+
+
+def _sorted(frame: pd.DataFrame):
+    return frame.sort_values(list(frame.columns)).reset_index(drop=True)
+
+
+@app.command()
+def rebuild():
+    """Build features, name table and state from all cleaned files"""
+    name_table = read_name_table() if NAME_TABLE_CSV.exists() else None
+    features, state, name_table = full_build(dp.read_names(), name_table)
+    features.to_csv(FEATURES_CSV)
+    ds.write_arrow(queries.name_profiles(features), PROFILES_ARROW)
+    ds.write_arrow(features, FEATURES_ARROW)
+    queries.name_diversity(features).to_csv(DIVERSITY_CSV, index=False)
+    name_table.to_csv(NAME_TABLE_CSV, index=False)
+    save_state(state)
+
+
+@app.command()
+def append(year: int):
+    """Append a year's cleaned files to the features"""
+    features = read_features()
+    features, state, name_table = append_year(
+        features, load_state(), read_name_table(), dp.read_names([year])
+    )
+    features.to_csv(FEATURES_CSV)
+    # the ranks of every year depend on all names, profiles are rebuilt
+    ds.write_arrow(queries.name_profiles(features), PROFILES_ARROW)
+    ds.write_arrow(features, FEATURES_ARROW)
+    # earlier years keep their diversity, only the new year is added
+    diversity = queries.name_diversity(queries.filter_names(features, jahr=year))
+    pd.concat([pd.read_csv(DIVERSITY_CSV), diversity]).to_csv(
+        DIVERSITY_CSV, index=False
+    )
+    name_table.to_csv(NAME_TABLE_CSV, index=False)
+    save_state(state)
+
+
+@app.command()
+def verify(year: int = typer.Option(2022, help="Year to append")):
+    """Check that appending a year equals a full rebuild"""
+    verify_append(year)
+    typer.echo(f"appending {year} matches the full rebuild")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,256 @@
+"""Choropleth map of the kiez
+
+The district geometry is bundled at data/geo/berlin_bezirke.geojson, one
+feature per kiez with the kiez name (as in data/cleaned) as feature id,
+simplified to about 50 m. It is made from a GeoJSON of the district
+boundaries in WGS84 with one feature per district (e.g. "ALKIS Berlin
+Bezirke" from the Geoportal Berlin) with:
+    python -m dev.kiez_map path/to/bezirke.geojson
+The bundled file was made from the Berlin neighbourhood boundaries of Inside
+Airbnb (CC BY 4.0, shipped with the esda package's notebooks), dissolved into
+the twelve districts.
+
+The map figure holds the geometry once and one frame per year that only
+carries that year's values, so switching years in the browser swaps the color
+array instead of rebuilding the figure.
+"""
+
+import functools
+import json
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+GEOJSON_PATH = (
+    pathlib.Path(__file__)
+    / ".."
+    / ".."
+    / ".."
+    / "data"
+    / "geo"
+    / "berlin_bezirke.geojson"
+).resolve()
+
+GEOMETRY_SOURCE = "District boundaries: Inside Airbnb, insideairbnb.com (CC BY 4.0)"
+
+METRICS = {
+    "names_per_100": "Distinct names per 100 registered names",
+    "names": "Distinct names",
+    "anzahl": "Registered names",
+}
+
+
+def _kiez_slug(name: str):
+    """Kiez name as used in data/cleaned, e.g. "Neukölln" -> "neukoelln" """
+    name = name.strip().lower().replace(" ", "-")
+    for umlaut, spelled in [("ö", "oe"), ("ü", "ue"), ("ä", "ae"), ("ß", "ss")]:
+        name = name.replace(umlaut, spelled)
+    return name
+
+
+def simplify_line(points: np.ndarray, tolerance: float):
+    """Douglas-Peucker simplification of a line or closed ring
+
+    Args:
+        points (np.ndarray): (n, 2) coordinates
+        tolerance (float): largest allowed distance to the original line
+
+    Returns:
+        np.ndarray: the kept coordinates, first and last always kept
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1 : end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(np.cross(segment, offsets)) / length
+        farthest = np.argmax(distances)
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.extend([(start, split), (split, end)])
+    return points[keep]
+
+
+def prepare_geometry(
+    source: str, target: pathlib.Path = GEOJSON_PATH, tolerance: float = 0.0005
+):
+    """Writes the simplified district geometry used by the map
+
+    Args:
+        source (str): GeoJSON of the Berlin districts in WGS84 coordinates
+        target (pathlib.Path, optional): where to write the map's geometry
+        tolerance (float, optional): simplification tolerance in degrees
+            (0.0005 is roughly 50 m)
+    """
+    with open(source) as f:
+        districts = json.load(f)
+
+    features = []
+    for feature in districts["features"]:
+        properties = feature["properties"]
+        name = next(
+            properties[key]
+            for key in ["name", "Name", "namgem", "Gemeinde_name", "BEZNAME"]
+            if key in properties
+        )
+        geometry = feature["geometry"]
+        polygons = (
+            [geometry["coordinates"]]
+            if geometry["type"] == "Polygon"
+            else geometry["coordinates"]
+        )
+        polygons = [
+            [
+                np.round(simplify_line(np.array(ring)[:, :2], tolerance), 5).tolist()
+                for ring in polygon
+            ]
+            for polygon in polygons
+        ]
+        features.append(
+            {
+                "type": "Feature",
+                "id": _kiez_slug(name),
+                "properties": {"name": name},
+                "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+            }
+        )
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with open(target, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+@functools.lru_cache(maxsize=None)
+def load_geometry(path: pathlib.Path = GEOJSON_PATH):
+    """The district geometry, read once per process
+
+    Args:
+        path (pathlib.Path, optional): simplified district GeoJSON
+
+    Returns:
+        dict: GeoJSON feature collection, None if the file does not exist
+    """
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def kiez_year_metrics(names: pd.DataFrame):
+    """Popularity and diversity figures per kiez and year in one grouped pass
+
+    Args:
+        names (pd.DataFrame): combined names dataset
+
+    Returns:
+        pd.DataFrame: indexed by ("jahr", "kiez") with "anzahl", "names",
+            "names_per_100" and the most frequent girl's ("top_w") and
+            boy's ("top_m") name
+    """
+    metrics = names.groupby(["jahr", "kiez"], observed=True).agg(
+        anzahl=("anzahl", "sum"), names=("vorname", "nunique")
+    )
+    metrics["names_per_100"] = 100 * metrics["names"] / metrics["anzahl"]
+
+    counts = (
+        names.groupby(["jahr", "kiez", "geschlecht", "vorname"], observed=True)[
+            "anzahl"
+        ]
+        .sum()
+        .reset_index()
+        .sort_values("anzahl", ascending=False, kind="stable")
+        .drop_duplicates(["jahr", "kiez", "geschlecht"])
+    )
+    top = counts.pivot(
+        index=["jahr", "kiez"], columns="geschlecht", values="vorname"
+    ).astype(str)
+    metrics["top_w"] = top.get("w")
+    metrics["top_m"] = top.get("m")
+    return metrics
+
+
+def choropleth_figure(metrics: pd.DataFrame, geometry: dict, metric: str):
+    """Map of one metric with a year slider
+
+    Args:
+        metrics (pd.DataFrame): output of `kiez_year_metrics`
+        geometry (dict): district GeoJSON with kiez names as feature ids
+        metric (str): one of METRICS
+
+    Returns:
+        go.Figure: choropleth with one frame per year
+    """
+    kiez = [feature["id"] for feature in geometry["features"]]
+    years = sorted(metrics.index.get_level_values("jahr").unique())
+
+    # years x kiez arrays, the frames are rows of these
+    values = metrics[metric].unstack("kiez").reindex(index=years, columns=kiez)
+    hover = (
+        (metrics["top_w"].astype(str) + " / " + metrics["top_m"].astype(str))
+        .unstack("kiez")
+        .reindex(index=years, columns=kiez)
+    )
+    z = values.to_numpy(dtype=float)
+    text = hover.fillna("").to_numpy()
+
+    def trace(i):
+        return go.Choropleth(z=z[i], text=text[i])
+
+    fig = go.Figure(
+        data=[
+            go.Choropleth(
+                geojson=geometry,
+                locations=kiez,
+                z=z[-1],
+                text=text[-1],
+                zmin=np.nanmin(z),
+                zmax=np.nanmax(z),
+                colorscale="Viridis",
+                colorbar={"title": METRICS[metric]},
+                hovertemplate="%{location}<br>"
+                + METRICS[metric]
+                + ": %{z:.1f}<br>Top names: %{text}<extra></extra>",
+            )
+        ],
+        frames=[
+            go.Frame(data=[trace(i)], name=str(year)) for i, year in enumerate(years)
+        ],
+    )
+    fig.update_geos(fitbounds="locations", visible=False)
+    fig.update_layout(
+        margin={"l": 0, "r": 0, "t": 30, "b": 0},
+        sliders=[
+            {
+                "active": len(years) - 1,
+                "currentvalue": {"prefix": "Year: "},
+                "steps": [
+                    {
+                        "label": str(year),
+                        "method": "animate",
+                        "args": [
+                            [str(year)],
+                            {"mode": "immediate", "frame": {"duration": 0}},
+                        ],
+                    }
+                    for year in years
+                ],
+            }
+        ],
+    )
+    return fig
+
+
+if __name__ == "__main__":
+    prepare_geometry(sys.argv[1])
@@ -0,0 +1,581 @@
+"""Load tests for the BabyNamesBerlin app and its local api
+
+Run from the bin folder:
+    python -m dev.load_test --source ../data/names_combined_features.csv
+    python -m dev.load_test api --source ../data/names_combined_features.csv
+    python -m dev.load_test app --sessions 1 4 16 --output results.json
+    python -m dev.load_test profile --sessions 4 --steps 10
+
+The app test serves the app with `streamlit run` and connects headless
+clients to it, which speak the websocket protocol of the pinned streamlit
+1.28, so its latencies are those of concurrent sessions and its memory is
+that of the server. The profile test runs sessions one rerun at a time
+through Streamlit's AppTest instead, to find slow pages. Both can compare
+their results against an earlier run with --compare.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import psutil
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.websocket import websocket_connect
+
+import dev.dataset as ds
+
+
+def simulate_session(names: pd.DataFrame):
+    """Applies the non-widget steps of the Home and Genders pages to a session's data
+
+    Filtered frames are dropped after use as they are at the end of a rerun,
+    only the session's dataset (with the column added by the Genders page)
+    is kept alive.
+
+    Args:
+        names (pd.DataFrame): the session's dataset
+
+    Returns:
+        pd.DataFrame: the session's dataset after rendering
+    """
+    home = names.loc[names.loc[:, "position"] == 1, :]
+    home = home.loc[home.loc[:, "geschlecht"] == "w", :]
+    home = home.loc[:, ["vorname", "kiez", "geschlecht", "jahr", "anzahl"]]
+    del home
+
+    names["gender_category"] = pd.cut(
+        names["gender_scale"], bins=[0.0, 0.2, 0.4, 0.6, 0.8, 1.0]
+    )
+    return names
+
+
+def session_memory(source: str, session_counts=(1, 10, 50, 100), shared=True):
+    """Measures the memory held by a growing number of simultaneous sessions
+
+    Args:
+        source (str): url or path of names_combined_features.csv
+        session_counts (tuple, optional): numbers of sessions to simulate
+        shared (bool, optional): use the shared dataset, otherwise every
+            session gets a private copy as before
+
+    Returns:
+        pd.DataFrame: memory in MB per number of sessions
+    """
+    ds.clear_cache()
+    ds.load_names(source)
+
+    results = []
+    for n_sessions in session_counts:
+        tracemalloc.start()
+        sessions = []
+        for _ in range(n_sessions):
+            names = ds.load_names(source)
+            if not shared:
+                names = names.copy()
+            sessions.append(simulate_session(names))
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append(
+            {
+                "sessions": n_sessions,
+                "shared": shared,
+                "memory_mb": current / 1e6,
+                "memory_per_session_mb": current / 1e6 / n_sessions,
+                "peak_mb": peak / 1e6,
+            }
+        )
+        del sessions
+
+    return pd.DataFrame(results)
+
+
+API_PATHS = [
+    "/top_names?n=30",
+    "/top_names?kiez=mitte&jahr=2022&n=10",
+    "/top_names?geschlecht=w&position=1&n=10",
+    "/timeseries?vorname=Marie&vorname=Sophie",
+    "/timeseries?vorname=Noah&kiez=pankow",
+    "/gender_stats",
+    "/gender_category?category=True+Unisex",
+    "/similar_names?vorname=Sofie&n=10",
+]
+
+
+async def _drive_api(base_url: str, paths: list, n_requests: int, concurrency: int):
+    """Sends `n_requests` requests spread over `concurrency` concurrent clients
+
+    Every client remembers the ETags it has seen and revalidates with them, as
+    a browser would.
+
+    Returns:
+        list: (path, status, latency in s) per request
+    """
+    client = AsyncHTTPClient(max_clients=concurrency)
+    rng = np.random.default_rng(0)
+    todo = list(rng.choice(paths, size=n_requests))
+    results = []
+
+    async def worker():
+        etags = {}
+        while todo:
+            path = todo.pop()
+            headers = {"If-None-Match": etags[path]} if path in etags else {}
+            start = time.perf_counter()
+            try:
+                response = await client.fetch(base_url + path, headers=headers)
+                status = response.code
+                etags[path] = response.headers.get("Etag")
+            except HTTPClientError as e:
+                status = e.code
+            results.append((path, status, time.perf_counter() - start))
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return results
+
+
+def api_load(source: str, concurrency_levels=(1, 8, 32), n_requests=500, port=8601):
+    """Measures latency and throughput of the local api (dev/api.py)
+
+    The api runs in its own process. Each concurrency level starts against a
+    fresh server, so the first requests include computing and caching.
+
+    Args:
+        source (str): url or path of names_combined_features.csv
+        concurrency_levels (tuple, optional): numbers of concurrent clients
+        n_requests (int, optional): requests per concurrency level
+        port (int, optional): port for the api
+
+    Returns:
+        pd.DataFrame: throughput and latency percentiles per concurrency level
+    """
+    base_url = f"http://127.0.0.1:{port}"
+    rows = []
+    for concurrency in concurrency_levels:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "dev.api", "--source", source, "--port", str(port)],
+            stdout=subprocess.PIPE,
+        )
+        try:
+            server.stdout.readline()  # printed once the dataset is loaded
+            start = time.perf_counter()
+            results = asyncio.run(
+                _drive_api(base_url, API_PATHS, n_requests, concurrency)
+            )
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+
+        latencies = np.array([r[2] for r in results]) * 1000
+        statuses = pd.Series([r[1] for r in results]).value_counts()
+        rows.append(
+            {
+                "concurrency": concurrency,
+                "requests": len(results),
+                "requests_per_s": len(results) / elapsed,
+                "p50_ms": np.percentile(latencies, 50),
+                "p95_ms": np.percentile(latencies, 95),
+                "p99_ms": np.percentile(latencies, 99),
+                "status_200": statuses.get(200, 0),
+                "status_304": statuses.get(304, 0),
+            }
+        )
+
+    return pd.DataFrame(rows)
+
+
+APP_PATH = (pathlib.Path(__file__) / ".." / ".." / "babynames_app.py").resolve()
+# widget elements the clients change; streamlit 1.28 sends choices as option
+# indices, and a select_slider is a "slider" with options
+_WIDGET_TYPES = ["radio", "selectbox", "multiselect", "checkbox", "slider"]
+# seconds between samples of the server's memory
+RSS_INTERVAL = 0.05
+
+
+def _random_state(widgets: dict, states: dict, rng: np.random.Generator):
+    """State of one randomly chosen widget of the current page, set to a random value
+
+    Switching pages is one of the options, through the sidebar's "Go to" radio.
+
+    Args:
+        widgets (dict): (element type, proto) per widget id of the last rerun
+        states (dict): WidgetState per widget id sent with the last rerun
+        rng (np.random.Generator): the session's random numbers
+
+    Returns:
+        WidgetState: the changed widget's new state
+    """
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+    widget_id = sorted(widgets)[rng.integers(len(widgets))]
+    kind, proto = widgets[widget_id]
+    state = WidgetState(id=widget_id)
+    if kind == "checkbox":
+        checked = states[widget_id].bool_value if widget_id in states else proto.default
+        state.bool_value = not checked
+    elif kind == "multiselect":
+        size = rng.integers(0, min(3, len(proto.options) + 1))
+        choice = rng.choice(len(proto.options), size=size, replace=False)
+        state.int_array_value.data[:] = choice.tolist()
+    elif kind == "slider" and proto.options:
+        choice = rng.integers(len(proto.options), size=len(proto.default))
+        state.double_array_value.data[:] = sorted(choice.tolist())
+    elif kind == "slider":
+        steps = rng.integers(0, round((proto.max - proto.min) / proto.step) + 1, 2)
+        values = proto.min + np.sort(steps)[: len(proto.default)] * proto.step
+        state.double_array_value.data[:] = values.round(10).tolist()
+    else:
+        state.int_value = int(rng.integers(len(proto.options)))
+    return state
+
+
+async def _rerun(connection, states: dict, cache: dict):
+    """Asks the server for a rerun with the given widget states, as the browser does
+
+    Args:
+        connection: websocket connection of the session
+        states (dict): WidgetState per widget id
+        cache (dict): messages by hash, the server sends references to
+            messages it sent the session before
+
+    Returns:
+        dict: (element type, proto) per widget id rendered by the rerun
+    """
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+    back_msg = BackMsg()
+    back_msg.rerun_script.query_string = ""
+    back_msg.rerun_script.widget_states.widgets.extend(states.values())
+    await connection.write_message(back_msg.SerializeToString(), binary=True)
+
+    widgets = {}
+    while True:
+        data = await connection.read_message()
+        if data is None:
+            raise ConnectionError("The app server closed the connection")
+        msg = ForwardMsg.FromString(data)
+        if msg.WhichOneof("type") == "ref_hash":
+            msg = cache[msg.ref_hash]
+        elif msg.hash:
+            cache[msg.hash] = msg
+        if msg.WhichOneof("type") == "script_finished":
+            return widgets
+        if msg.WhichOneof("type") != "delta" or not msg.delta.HasField("new_element"):
+            continue
+        element = msg.delta.new_element
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            raise RuntimeError(element.exception.message)
+        if kind in _WIDGET_TYPES:
+            proto = getattr(element, kind)
+            widgets[proto.id] = (kind, proto)
+
+
+async def _app_session(url: str, seed: int, steps: int, latencies: list):
+    """Runs one session against the server: a first load and `steps` widget changes
+
+    Like the browser, the session keeps the state of every widget it has
+    changed and sends them all with each rerun.
+
+    Args:
+        url (str): websocket url of the app server
+        seed (int): seed for the session's interactions
+        steps (int): number of random widget interactions
+        latencies (list): rerun latencies in s are appended here
+    """
+    rng = np.random.default_rng(seed)
+    connection = await websocket_connect(url, max_message_size=1 << 30)
+    states, cache = {}, {}
+    try:
+        for step in range(steps + 1):
+            if step > 0:
+                state = _random_state(widgets, states, rng)
+                states[state.id] = state
+            start = time.perf_counter()
+            try:
+                widgets = await _rerun(connection, states, cache)
+            except RuntimeError as e:
+                raise RuntimeError(f"session {seed}: {e}") from e
+            latencies.append(time.perf_counter() - start)
+            # states of widgets that are gone are dropped, like the browser does
+            states = {i: state for i, state in states.items() if i in widgets}
+    finally:
+        connection.close()
+
+
+def _rss(process: psutil.Process):
+    """Resident memory in bytes of a process and its children"""
+    processes = [process] + process.children(recursive=True)
+    return sum(p.memory_info().rss for p in processes)
+
+
+async def _drive_app(url: str, n_sessions: int, steps: int, server: psutil.Process):
+    """Runs `n_sessions` concurrent sessions while sampling the server's memory
+
+    Returns:
+        tuple: rerun latencies in s, peak rss of the server in bytes
+    """
+    latencies = []
+    peak = _rss(server)
+
+    async def sample():
+        nonlocal peak
+        while True:
+            peak = max(peak, _rss(server))
+            await asyncio.sleep(RSS_INTERVAL)
+
+    sampler = asyncio.create_task(sample())
+    try:
+        await asyncio.gather(
+            *[_app_session(url, seed, steps, latencies) for seed in range(n_sessions)]
+        )
+    finally:
+        sampler.cancel()
+    return latencies, max(peak, _rss(server))
+
+
+def _wait_for_server(base_url: str, server: subprocess.Popen, timeout=120):
+    """Waits until a started app server answers its health check"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The app server exited on start")
+        try:
+            with urllib.request.urlopen(f"{base_url}/_stcore/health") as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"The app server didn't start within {timeout} s")
+
+
+def app_load(source: str, session_counts=(1, 4, 16), steps=10, port=8701):
+    """Drives concurrent sessions through the pages of the served app
+
+    Every number of sessions starts a fresh `streamlit run` server in its own
+    process, and connects that many headless clients to it over the websocket
+    a browser uses. The server runs their reruns in parallel threads, so the
+    latencies are those clients see, including the first load of the dataset.
+    The server's memory is measured once it is up, before any session
+    (baseline), and sampled while the sessions run (peak).
+
+    Args:
+        source (str): url or path of names_combined_features.csv
+        session_counts (tuple, optional): numbers of concurrent sessions
+        steps (int, optional): widget interactions per session
+        port (int, optional): port for the app server
+
+    Returns:
+        pd.DataFrame: latency percentiles, server cpu and memory per number of
+            sessions
+    """
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, "-m", "streamlit", "run", str(APP_PATH)]
+    command += ["--server.headless", "true", "--server.port", str(port)]
+    command += ["--browser.gatherUsageStats", "false"]
+    env = dict(os.environ, BABYNAMES_SOURCE=source)
+
+    rows = []
+    for n_sessions in session_counts:
+        server = subprocess.Popen(
+            command, cwd=APP_PATH.parent, env=env, stdout=subprocess.DEVNULL
+        )
+        try:
+            _wait_for_server(base_url, server)
+            process = psutil.Process(server.pid)
+            baseline = _rss(process)
+            cpu_start = process.cpu_times()
+            start = time.perf_counter()
+            latencies, peak = asyncio.run(
+                _drive_app(
+                    f"ws://127.0.0.1:{port}/_stcore/stream", n_sessions, steps, process
+                )
+            )
+            elapsed = time.perf_counter() - start
+            cpu_end = process.cpu_times()
+        finally:
+            server.terminate()
+            server.wait()
+
+        cpu = (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+        latencies = np.array(latencies) * 1000
+        rows.append(
+            {
+                "sessions": n_sessions,
+                "reruns": len(latencies),
+                "reruns_per_s": len(latencies) / elapsed,
+                "p50_ms": np.percentile(latencies, 50),
+                "p95_ms": np.percentile(latencies, 95),
+                "p99_ms": np.percentile(latencies, 99),
+                "cpu_percent": 100 * cpu / elapsed,
+                "baseline_rss_mb": baseline / 1e6,
+                "peak_rss_mb": peak / 1e6,
+                "rss_per_session_mb": (peak - baseline) / 1e6 / n_sessions,
+            }
+        )
+
+    return pd.DataFrame(rows)
+
+
+APP_WIDGETS = ["radio", "select_slider", "multiselect", "checkbox", "slider"]
+PROFILE_NOTE = (
+    "Reruns run one at a time in this process through AppTest, without a "
+    "server, so they show where a rerun spends its time, not served latencies."
+)
+
+
+def _random_interaction(at, rng: np.random.Generator):
+    """Changes one randomly chosen widget of the current page to a random value
+
+    Switching pages is one of the options, through the sidebar's "Go to" radio.
+    """
+    widgets = [widget for kind in APP_WIDGETS for widget in getattr(at, kind)]
+    widget = widgets[rng.integers(len(widgets))]
+    if widget.type == "checkbox":
+        widget.set_value(not widget.value)
+    elif widget.type == "multiselect":
+        size = rng.integers(0, min(3, len(widget.options) + 1))
+        widget.set_value(list(rng.choice(widget.options, size=size, replace=False)))
+    elif widget.type == "slider":
+        low, high = sorted(rng.uniform(widget.min, widget.max, size=2))
+        widget.set_range(low, high)
+    else:
+        widget.set_value(rng.choice(widget.options))
+
+
+def app_profile(source: str, n_sessions=4, steps=10):
+    """Per-rerun latency of the app's pages, one rerun at a time
+
+    Simulated sessions run one after another through Streamlit's AppTest
+    (streamlit>=1.28) in this process, so no rerun waits for another and
+    slow downs in the helper functions show up per page. Use `app_load` for
+    latencies and memory under concurrent sessions.
+
+    Args:
+        source (str): url or path of names_combined_features.csv
+        n_sessions (int, optional): number of simulated sessions
+        steps (int, optional): widget interactions per session
+
+    Returns:
+        pd.DataFrame: latency percentiles per page
+    """
+    from streamlit.testing.v1 import AppTest
+
+    os.environ["BABYNAMES_SOURCE"] = source
+    reruns = []
+    for seed in range(n_sessions):
+        rng = np.random.default_rng(seed)
+        at = AppTest.from_file(str(APP_PATH), default_timeout=300)
+        for step in range(steps + 1):
+            if step > 0:
+                _random_interaction(at, rng)
+            start = time.perf_counter()
+            at.run()
+            latency = time.perf_counter() - start
+            if at.exception:
+                raise RuntimeError(f"session {seed}: {at.exception[0].message}")
+            reruns.append((at.sidebar.radio[0].value, latency * 1000))
+
+    latencies = pd.DataFrame(reruns, columns=["page", "latency_ms"])
+    return (
+        latencies.groupby("page")["latency_ms"]
+        .agg(
+            reruns="count",
+            p50_ms="median",
+            p95_ms=lambda x: np.percentile(x, 95),
+            max_ms="max",
+        )
+        .reset_index()
+    )
+
+
+def save_results(report: pd.DataFrame, path: str, test: str, note: str = None):
+    """Writes a load test report with the commit it was measured on as json"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    results = {
+        "test": test,
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "note": note,
+        "results": report.to_dict(orient="records"),
+    }
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def compare_results(report: pd.DataFrame, path: str):
+    """Ratio of every metric to an earlier saved run (> 1 means higher now)
+
+    Args:
+        report (pd.DataFrame): the current results
+        path (str): json written by `save_results`
+
+    Returns:
+        pd.DataFrame: current / earlier per metric, matched on the first column
+    """
+    with open(path) as f:
+        earlier = pd.DataFrame(json.load(f)["results"])
+    key = report.columns[0]
+    return (report.set_index(key) / earlier.set_index(key)).dropna(how="all")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "test",
+        nargs="?",
+        choices=["memory", "api", "app", "profile"],
+        default="memory",
+    )
+    parser.add_argument("--source", default=ds.default_source())
+    parser.add_argument("--sessions", type=int, nargs="+", default=None)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--output", help="Save the results as json")
+    parser.add_argument("--compare", help="Compare with results saved earlier")
+    args = parser.parse_args()
+
+    ds.enable_copy_on_write()
+    note = None
+    if args.test == "api":
+        report = api_load(args.source, args.concurrency, args.requests)
+    elif args.test == "app":
+        report = app_load(args.source, args.sessions or [1, 4, 16], args.steps)
+    elif args.test == "profile":
+        sessions = args.sessions[0] if args.sessions else 4
+        report = app_profile(args.source, sessions, args.steps)
+        note = PROFILE_NOTE
+    else:
+        sessions = args.sessions or [1, 10, 50, 100]
+        report = pd.concat(
+            [
+                session_memory(args.source, sessions, shared=True),
+                session_memory(args.source, sessions, shared=False),
+            ]
+        )
+    print(report.to_string(index=False))
+    if note:
+        print(f"Note: {note}")
+
+    if args.output:
+        save_results(report, args.output, args.test, note)
+    if args.compare:
+        print(compare_results(report, args.compare).to_string())
@@ -0,0 +1,339 @@
+"""Widget-free queries on the combined names dataset
+
+These are the aggregations behind the dashboard, usable outside Streamlit
+(e.g. by the local JSON api in dev/api.py).
+"""
+
+import numpy as np
+import pandas as pd
+from Levenshtein import distance
+
+GENDER_BINS = [0.0, 0.2, 0.4, 0.6, 0.8, 1.0]
+GENDER_LABELS = [
+    "Predominantly Male",
+    "Male-leaning Unisex",
+    "True Unisex",
+    "Female-leaning Unisex",
+    "Predominantly Female",
+]
+DIVERSITY_GROUPS = ["kiez", "jahr", "geschlecht"]
+
+
+def _as_list(value):
+    if value is None or isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+def filter_names(
+    names: pd.DataFrame, kiez=None, jahr=None, geschlecht=None, position=None
+):
+    """Filters the dataset, every argument accepts a single value or a list
+
+    Args:
+        names (pd.DataFrame): combined names dataset
+        kiez (str | list, optional): kiez name(s), all kiez if None
+        jahr (int | list, optional): year(s), all years if None
+        geschlecht (str | list, optional): "m" and/or "w", both if None
+        position (int | list, optional): name position(s), all if None
+
+    Returns:
+        pd.DataFrame: the matching rows
+    """
+    mask = pd.Series(True, index=names.index)
+    for column, value in [
+        ("kiez", kiez),
+        ("jahr", jahr),
+        ("geschlecht", geschlecht),
+        ("position", position),
+    ]:
+        value = _as_list(value)
+        if value is not None:
+            mask &= names.loc[:, column].isin(value)
+    return names.loc[mask, :]
+
+
+def top_names(
+    names: pd.DataFrame, kiez=None, jahr=None, geschlecht=None, position=None, n=10
+):
+    """Most popular names for a selection of kiez, years, genders and positions
+
+    Args:
+        names (pd.DataFrame): combined names dataset
+        n (int, optional): number of names to return
+
+    Returns:
+        pd.DataFrame: "vorname", "geschlecht" and summed "anzahl", most popular first
+    """
+    selection = filter_names(names, kiez, jahr, geschlecht, position)
+    return (
+        selection.groupby(["vorname", "geschlecht"], observed=True)["anzahl"]
+        .sum()
+        .nlargest(n)
+        .reset_index()
+    )
+
+
+def name_timeseries(names: pd.DataFrame, vorname, kiez=None, geschlecht=None):
+    """Yearly counts of one or more names
+
+    Args:
+        names (pd.DataFrame): combined names dataset
+        vorname (str | list): name(s) to look up
+        kiez (str | list, optional): kiez name(s), all kiez if None
+        geschlecht (str | list, optional): "m" and/or "w", both if None
+
+    Returns:
+        pd.DataFrame: "jahr", "vorname" and summed "anzahl", zero filled for every year
+    """
+    years = sorted(names.loc[:, "jahr"].unique())
+    vorname = _as_list(vorname)
+    selection = filter_names(names, kiez=kiez, geschlecht=geschlecht)
+    selection = selection.loc[selection.loc[:, "vorname"].isin(vorname), :]
+
+    timeseries = (
+        selection.groupby(["jahr", "vorname"], observed=True)["anzahl"]
+        .sum()
+        .unstack("vorname")
+        .reindex(index=years, columns=vorname)
+        .fillna(0)
+        .astype(int)
+    )
+    return timeseries.stack().rename("anzahl").reset_index()
+
+
+def gender_category_counts(names: pd.DataFrame, position=None):
+    """Number of rows, names and babies per gender category
+
+    Args:
+        names (pd.DataFrame): combined names dataset with a "gender_scale" column
+        position (int | list, optional): name position(s), all if None
+
+    Returns:
+        pd.DataFrame: "gender_category", "rows", "names" and "anzahl" per category
+    """
+    selection = filter_names(names, position=position)
+    categories = pd.cut(
+        selection["gender_scale"], bins=GENDER_BINS, labels=GENDER_LABELS
+    )
+    return (
+        selection.groupby(categories, observed=False)
+        .agg(
+            rows=("anzahl", "size"),
+            names=("vorname", "nunique"),
+            anzahl=("anzahl", "sum"),
+        )
+        .rename_axis("gender_category")
+        .reset_index()
+    )
+
+
+def gender_category_names(names: pd.DataFrame, category: str, position=None):
+    """Names in a gender category, aggregated over kiez and years
+
+    Args:
+        names (pd.DataFrame): combined names dataset with a "gender_scale" column
+        category (str): one of GENDER_LABELS
+        position (int | list, optional): name position(s), all if None
+
+    Returns:
+        pd.DataFrame: "vorname", "anzahl", "gender_scale" and "unisex_score",
+            sorted by gender scale
+    """
+    selection = filter_names(names, position=position)
+    categories = pd.cut(
+        selection["gender_scale"], bins=GENDER_BINS, labels=GENDER_LABELS
+    )
+    selection = selection.loc[categories == category, :]
+    return (
+        selection.groupby("vorname", observed=True)
+        .agg(
+            {
+                "anzahl": "sum",
+                "gender_scale": "mean",
+                "unisex_score": "mean",
+            }
+        )
+        .reset_index()
+        .sort_values(["gender_scale"], ascending=[True])
+    )
+
+
+def name_diversity(names: pd.DataFrame, position=1, top_k=10):
+    """Diversity of the names given per kiez, year and gender
+
+    Every name's share is computed once, the metrics are sums of per-row terms
+    collected by one groupby. Apart from sorting the counts, the work is
+    linear in the number of rows.
+
+    Args:
+        names (pd.DataFrame): combined names dataset
+        position (int | list, optional): name position(s), all if None.
+            Defaults to first names; before 2017 all names count as first names.
+        top_k (int, optional): number of names in "top_share"
+
+    Returns:
+        pd.DataFrame: per DIVERSITY_GROUPS the "anzahl" of names given,
+            distinct "names", Shannon "entropy" (nats), "effective_names"
+            (exp of the entropy), "gini" coefficient of the counts and
+            "top_share" of the `top_k` most frequent names
+    """
+    counts = (
+        filter_names(names, position=position)
+        .groupby(DIVERSITY_GROUPS + ["vorname"], observed=True)["anzahl"]
+        .sum()
+        .reset_index()
+    )
+    counts = counts.loc[counts.loc[:, "anzahl"] > 0, :].sort_values(
+        DIVERSITY_GROUPS + ["anzahl"],
+        ascending=[True] * len(DIVERSITY_GROUPS) + [False],
+        kind="stable",
+    )
+    groups = counts.groupby(DIVERSITY_GROUPS, observed=True, sort=False)
+    x = counts.loc[:, "anzahl"].to_numpy(dtype=float)
+    total = groups["anzahl"].transform("sum").to_numpy(dtype=float)
+    size = groups["anzahl"].transform("size").to_numpy()
+    rank = groups.cumcount().to_numpy()  # 0 for the most frequent name
+
+    p = x / total
+    counts["plogp"] = p * np.log(p)
+    # Gini from the counts in ascending order: 2 * sum(i * x_i) / (n * sum(x)) - (n + 1) / n
+    counts["gini"] = 2 * (size - rank) * p / size - (size + 1) / size**2
+    counts["top_share"] = np.where(rank < top_k, p, 0.0)
+
+    diversity = groups.agg(
+        anzahl=("anzahl", "sum"),
+        names=("anzahl", "size"),
+        plogp=("plogp", "sum"),
+        gini=("gini", "sum"),
+        top_share=("top_share", "sum"),
+    )
+    diversity.insert(2, "entropy", -diversity.pop("plogp"))
+    diversity.insert(3, "effective_names", np.exp(diversity.loc[:, "entropy"]))
+    return diversity.reset_index()
+
+
+def name_variants(names: pd.DataFrame, vorname: str):
+    """Counts of the spelling variants of a name (see dev/variants.py)
+
+    Args:
+        names (pd.DataFrame): combined names dataset with a "cluster_id" column
+        vorname (str): name to look up
+
+    Returns:
+        pd.DataFrame: "vorname" and summed "anzahl" of every name in the
+            cluster of `vorname`, most frequent first
+    """
+    clusters = names.loc[names.loc[:, "vorname"] == vorname, "cluster_id"].unique()
+    variants = names.loc[names.loc[:, "cluster_id"].isin(clusters), :]
+    return (
+        variants.groupby("vorname", observed=True)["anzahl"]
+        .sum()
+        .sort_values(ascending=False)
+        .reset_index()
+    )
+
+
+def name_profiles(names: pd.DataFrame):
+    """One profile row per name, over all kiez, genders and positions
+
+    Per-year values are stored in one column per year ("anzahl_2012",
+    "rank_2012", ...), so every column has a fixed width and the table can
+    be memory-mapped (see `dataset.load_profiles`).
+
+    Args:
+        names (pd.DataFrame): combined names dataset
+
+    Returns:
+        pd.DataFrame: "vorname", "total", "first_year", "last_year",
+            "peak_year" (most babies, the earliest on ties), "peak_kiez",
+            "gender_scale" (share of girls), the yearly "anzahl_<year>" and
+            the yearly "rank_<year>" among all names (1 for the most
+            frequent, 0 if the name was not given), sorted by name
+    """
+    yearly = (
+        names.groupby(["vorname", "jahr"], observed=True)["anzahl"]
+        .sum()
+        .unstack("jahr", fill_value=0)
+    )
+    yearly.columns = yearly.columns.astype(int)
+    given = yearly > 0
+    ranks = yearly.rank(ascending=False, method="min").where(given, 0)
+    kiez = (
+        names.groupby(["vorname", "kiez"], observed=True)["anzahl"]
+        .sum()
+        .unstack("kiez", fill_value=0)
+    )
+    girls = (
+        filter_names(names, geschlecht="w")
+        .groupby("vorname", observed=True)["anzahl"]
+        .sum()
+        .reindex(yearly.index, fill_value=0)
+    )
+
+    total = yearly.sum(axis=1)
+    profiles = pd.DataFrame(
+        {
+            "total": total,
+            "first_year": given.idxmax(axis=1),
+            "last_year": given.iloc[:, ::-1].idxmax(axis=1),
+            "peak_year": yearly.idxmax(axis=1),
+            "peak_kiez": kiez.idxmax(axis=1).reindex(yearly.index),
+            "gender_scale": girls / total,
+        }
+    )
+    return pd.concat(
+        [
+            profiles,
+            yearly.astype("int32").add_prefix("anzahl_"),
+            ranks.astype("int32").add_prefix("rank_"),
+        ],
+        axis=1,
+    ).reset_index()
+
+
+def name_profile(profiles: pd.DataFrame, vorname: str):
+    """Profile of one name
+
+    Args:
+        profiles (pd.DataFrame): `name_profiles` indexed by "vorname"
+        vorname (str): name to look up, raises KeyError if it was never given
+
+    Returns:
+        dict: the scalar fields of `name_profiles`, plus "anzahl" and "rank"
+            as pd.Series indexed by year
+    """
+    row = profiles.iloc[profiles.index.get_loc(vorname)]
+    profile = {"vorname": vorname}
+    for column in profiles.columns:
+        if not column.startswith(("anzahl_", "rank_")):
+            profile[column] = row[column]
+    for field in ["anzahl", "rank"]:
+        series = row.filter(like=f"{field}_").astype(int)
+        series.index = series.index.str.removeprefix(f"{field}_").astype(int)
+        profile[field] = series.rename_axis("jahr").rename(field)
+    return profile
+
+
+def levenshtein_similarity(name, names, n=10):
+    """Find the `n` names most similar to `name` based on Levenshtein distance."""
+    distances = [(other_name, distance(name, other_name)) for other_name in names]
+    distances.sort(key=lambda x: x[1])
+    return {
+        name: dist for name, dist in distances[:n]
+    }  # [name for name, dist in distances[:n]]
+
+
+def similar_names(names: pd.DataFrame, vorname: str, n=10):
+    """Names closest to `vorname` by Levenshtein distance
+
+    Args:
+        names (pd.DataFrame): combined names dataset
+        vorname (str): name to compare against
+        n (int, optional): number of names to return
+
+    Returns:
+        dict: name -> distance, closest first
+    """
+    all_names = sorted(names.loc[:, "vorname"].unique())
+    return levenshtein_similarity(vorname, all_names, n=n)
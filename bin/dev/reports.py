@@ -0,0 +1,168 @@
+"""Batch reports per kiez and year
+
+Run from the bin folder:
+    python -m dev.reports --top-n 20 --format parquet
+
+Writes one folder per kiez (plus "berlin" for all kiez together) with a top-N
+table per year, the timeseries of the kiez' top names and a chart of it.
+Kiez are processed in parallel; outputs newer than the source dataset are
+left alone unless --force is given.
+"""
+
+import concurrent.futures
+import os
+import pathlib
+from typing import List
+
+import pandas as pd
+import typer
+from rich.progress import Progress
+
+import dev.dataset as ds
+import dev.queries as queries
+
+FEATURES_CSV = (
+    pathlib.Path(__file__) / ".." / ".." / ".." / "data" / "names_combined_features.csv"
+).resolve()
+REPORTS_PATH = (pathlib.Path(__file__) / ".." / ".." / ".." / "reports").resolve()
+BERLIN = "berlin"
+
+app = typer.Typer()
+
+
+def report_outputs(out_dir: pathlib.Path, kiez: str, years: list, top_n: int, fmt: str):
+    """Lists the files written for one kiez
+
+    Args:
+        out_dir (pathlib.Path): reports folder
+        kiez (str): kiez name or BERLIN
+        years (list): years with a top-N table
+        top_n (int): number of names per table
+        fmt (str): "csv" or "parquet" for the timeseries
+
+    Returns:
+        list: output paths
+    """
+    kiez_dir = out_dir / kiez
+    return [kiez_dir / f"{year}_top{top_n}.csv" for year in years] + [
+        kiez_dir / f"timeseries_top{top_n}.{fmt}",
+        kiez_dir / f"timeseries_top{top_n}.png",
+    ]
+
+
+def is_up_to_date(outputs: list, source: pathlib.Path):
+    """True if every output exists and is newer than the source dataset"""
+    source_mtime = os.path.getmtime(source)
+    return all(
+        output.exists() and os.path.getmtime(output) >= source_mtime
+        for output in outputs
+    )
+
+
+def plot_timeseries(timeseries: pd.DataFrame, title: str, path: pathlib.Path):
+    """Saves a line chart of a year x name table as png"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+    timeseries.plot(ax=ax)
+    ax.set_title(title)
+    ax.set_xlabel("Year")
+    ax.set_ylabel("Count")
+    ax.legend(loc="center left", bbox_to_anchor=(1.0, 0.5), fontsize="small")
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def kiez_report(
+    source: str, out_dir: pathlib.Path, kiez: str, years: list, top_n: int, fmt: str
+):
+    """Writes the top-N tables, timeseries and chart for one kiez
+
+    Args:
+        source (str): path of names_combined_features.csv
+        out_dir (pathlib.Path): reports folder
+        kiez (str): kiez name or BERLIN for all kiez
+        years (list): years with a top-N table
+        top_n (int): number of names per table and in the timeseries
+        fmt (str): "csv" or "parquet" for the timeseries
+
+    Returns:
+        str: the kiez
+    """
+    names = ds.load_names(source)
+    if kiez != BERLIN:
+        names = queries.filter_names(names, kiez=kiez)
+
+    outputs = report_outputs(out_dir, kiez, years, top_n, fmt)
+    tables, timeseries_path, chart_path = outputs[:-2], outputs[-2], outputs[-1]
+    tables[0].parent.mkdir(parents=True, exist_ok=True)
+
+    for year, path in zip(years, tables):
+        queries.top_names(names, jahr=year, n=top_n).to_csv(path, index=False)
+
+    top = queries.top_names(names, n=top_n).loc[:, "vorname"].unique().tolist()
+    timeseries = queries.name_timeseries(names, top).pivot(
+        index="jahr", columns="vorname", values="anzahl"
+    )
+    timeseries = timeseries.loc[:, top]
+    if fmt == "parquet":
+        timeseries.to_parquet(timeseries_path)
+    else:
+        timeseries.to_csv(timeseries_path)
+
+    plot_timeseries(timeseries, f"{kiez}'s top {top_n} names", chart_path)
+    return kiez
+
+
+@app.command()
+def reports(
+    source: pathlib.Path = typer.Option(
+        FEATURES_CSV, help="names_combined_features.csv"
+    ),
+    out: pathlib.Path = typer.Option(REPORTS_PATH, help="Reports folder"),
+    kiez: List[str] = typer.Option(None, help="Kiez to report, default all"),
+    year: List[int] = typer.Option(None, help="Years to report, default all"),
+    top_n: int = typer.Option(10, help="Names per table"),
+    fmt: str = typer.Option(
+        "csv", "--format", help="Timeseries format, csv or parquet"
+    ),
+    workers: int = typer.Option(None, help="Worker processes, default one per cpu"),
+    force: bool = typer.Option(False, help="Rebuild outputs that are up to date"),
+):
+    """Generate per-kiez and per-year report bundles"""
+    if fmt not in ("csv", "parquet"):
+        raise typer.BadParameter("format must be csv or parquet")
+
+    ds.enable_copy_on_write()
+    names = ds.load_names(str(source))
+    kiez = kiez or sorted(names.loc[:, "kiez"].unique()) + [BERLIN]
+    year = year or sorted(int(y) for y in names.loc[:, "jahr"].unique())
+
+    todo = [
+        k
+        for k in kiez
+        if force or not is_up_to_date(report_outputs(out, k, year, top_n, fmt), source)
+    ]
+    typer.echo(f"{len(kiez) - len(todo)} of {len(kiez)} kiez reports up to date")
+    if not todo:
+        return
+
+    with Progress() as progress, concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=ds.enable_copy_on_write
+    ) as pool:
+        task = progress.add_task("Writing reports", total=len(todo))
+        futures = [
+            pool.submit(kiez_report, str(source), out, k, year, top_n, fmt)
+            for k in todo
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            progress.console.print(f"... {future.result()}")
+            progress.advance(task)
+
+
+if __name__ == "__main__":
+    app()
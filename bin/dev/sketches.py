@@ -0,0 +1,260 @@
+"""Mergeable heavy-hitter sketches for top names without the full table
+
+Run from the bin folder:
+    python -m dev.sketches --k 100 --k 1000 --width 4096
+
+A `SpaceSaving` summary keeps at most k names with an upper bound of their
+count and the most it can overestimate it, a `CountMin` sketch answers the
+count of any name from a fixed size table. Both are built per partition (one
+year and kiez, see `data_processing.sketch_names_all`) and merged into the
+sketch of any set of partitions, also when they were built by other
+processes. The report compares the merged sketches' top names with the exact
+pandas result on the Berlin data.
+"""
+
+from typing import List
+
+import numpy as np
+import pandas as pd
+import typer
+
+# fixed keys, so items hash the same in every process
+HASH_KEYS = ["babynames-berlin", "sketch-hash-two!"]
+
+app = typer.Typer()
+
+
+class SpaceSaving:
+    """Top-k summary of weighted counts
+
+    Every kept item's count is at most `error` above its true count, items
+    not kept have a true count of at most `min_count`.
+
+    Args:
+        k (int): number of items kept
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.counts = pd.Series(dtype="int64")
+        self.errors = pd.Series(dtype="int64")
+
+    @property
+    def min_count(self):
+        """Upper bound of the count of any item that is not kept"""
+        return int(self.counts.min()) if len(self.counts) == self.k else 0
+
+    def _truncate(self, counts: pd.Series, errors: pd.Series):
+        # dropped items are at most the smallest kept count, see `min_count`
+        self.counts = counts.sort_values(ascending=False, kind="stable").iloc[: self.k]
+        self.errors = errors.reindex(self.counts.index)
+
+    def update(self, items, weights):
+        """Adds a batch of items, e.g. the rows of one file
+
+        Args:
+            items (array-like): item keys, repeated keys are summed
+            weights (array-like): count of every item
+        """
+        batch = pd.Series(np.asarray(weights, dtype="int64"), index=items)
+        batch = batch.groupby(level=0, sort=False).sum()
+        other = SpaceSaving(self.k)
+        other._truncate(batch, pd.Series(0, index=batch.index, dtype="int64"))
+        return self.merge(other)
+
+    def merge(self, other: "SpaceSaving"):
+        """Adds another summary, built over disjoint data
+
+        An item missing from a summary counts with that summary's `min_count`
+        (as count and as error), so counts stay upper bounds and
+        count - error stays a lower bound.
+
+        Args:
+            other (SpaceSaving): summary with the same k
+        """
+        index = self.counts.index.union(other.counts.index, sort=False)
+        own_min, other_min = self.min_count, other.min_count
+        counts = self.counts.reindex(index, fill_value=own_min) + other.counts.reindex(
+            index, fill_value=other_min
+        )
+        errors = self.errors.reindex(index, fill_value=own_min) + other.errors.reindex(
+            index, fill_value=other_min
+        )
+        self._truncate(counts, errors)
+        return self
+
+    def top(self, n: int = 10):
+        """The n items with the highest counts
+
+        Returns:
+            pd.DataFrame: "item", "count" (upper bound) and "error"
+        """
+        return pd.DataFrame(
+            {
+                "item": self.counts.index[:n],
+                "count": self.counts.iloc[:n].to_numpy(),
+                "error": self.errors.iloc[:n].to_numpy(),
+            }
+        )
+
+    def nbytes(self):
+        return int(
+            self.counts.memory_usage(deep=True) + self.errors.memory_usage(index=False)
+        )
+
+
+class CountMin:
+    """Count-Min sketch of weighted counts
+
+    Estimates never undercount; with total count N they overcount by more than
+    e * N / width with a probability of at most exp(-depth).
+
+    Args:
+        width (int): counters per row
+        depth (int): rows, each with its own hash function
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype="int64")
+
+    def _columns(self, items):
+        items = np.asarray(items, dtype=object)
+        h1, h2 = (pd.util.hash_array(items, hash_key=key) for key in HASH_KEYS)
+        rows = np.arange(self.depth, dtype="uint64")[:, None]
+        return ((h1[None, :] + rows * h2[None, :]) % np.uint64(self.width)).astype(
+            "int64"
+        )
+
+    def update(self, items, weights):
+        """Adds a batch of items, repeated keys are summed"""
+        columns = self._columns(items)
+        weights = np.asarray(weights, dtype="int64")
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], weights)
+
+    def estimate(self, items):
+        """Upper bounds of the counts of the items
+
+        Returns:
+            np.ndarray: one count per item
+        """
+        columns = self._columns(items)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other: "CountMin"):
+        """Adds another sketch with the same width and depth"""
+        if self.table.shape != other.table.shape:
+            raise ValueError("only sketches of the same width and depth merge")
+        self.table += other.table
+        return self
+
+    def nbytes(self):
+        return self.table.nbytes
+
+
+def merge_sketches(sketches):
+    """Merges (SpaceSaving, CountMin) pairs, e.g. all partitions of a year
+
+    Args:
+        sketches (iterable): (SpaceSaving, CountMin) tuples
+
+    Returns:
+        tuple: merged SpaceSaving and CountMin
+    """
+    sketches = list(sketches)
+    space_saving = SpaceSaving(sketches[0][0].k)
+    count_min = CountMin(sketches[0][1].width, sketches[0][1].depth)
+    for other_space_saving, other_count_min in sketches:
+        space_saving.merge(other_space_saving)
+        count_min.merge(other_count_min)
+    return space_saving, count_min
+
+
+def top_items(space_saving: SpaceSaving, count_min: CountMin, n: int = 10):
+    """Top n items with counts tightened by the Count-Min sketch
+
+    Returns:
+        pd.DataFrame: "item", "count" (upper bound) and "error"
+    """
+    top = space_saving.top(len(space_saving.counts))
+    estimate = count_min.estimate(top.loc[:, "item"].to_numpy())
+    tightened = np.minimum(top.loc[:, "count"], estimate)
+    top["error"] = (top.loc[:, "error"] - (top.loc[:, "count"] - tightened)).clip(
+        lower=0
+    )
+    top["count"] = tightened
+    return top.sort_values("count", ascending=False, kind="stable").head(n)
+
+
+def accuracy_report(
+    k_values: list, widths: list, depth: int = 4, top_n: int = 20, workers=None
+):
+    """Sketch top names against the exact counts of all Berlin data
+
+    Args:
+        k_values (list): SpaceSaving sizes to try
+        widths (list): Count-Min widths to try
+        depth (int, optional): Count-Min depth
+        top_n (int, optional): length of the compared top lists
+        workers (int, optional): worker processes, default one per cpu
+
+    Returns:
+        pd.DataFrame: per setting the sketch memory (next to that of the
+            exact counts of all names), the recall of the exact top_n and the
+            largest relative count error among them
+    """
+    import dev.data_processing as dp
+
+    exact = dp.sketch_items(dp.read_names()).groupby(level=0).sum()
+    exact_kib = exact.memory_usage(deep=True) / 1024
+    exact = exact.nlargest(top_n)
+
+    rows = []
+    for k in k_values:
+        for width in widths:
+            sketches = dp.sketch_names_all(
+                k=k, width=width, depth=depth, workers=workers
+            )
+            space_saving, count_min = merge_sketches(sketches.values())
+            top = top_items(space_saving, count_min, top_n).set_index("item")
+            found = exact.index.intersection(top.index)
+            estimates = np.minimum(
+                space_saving.counts.reindex(
+                    exact.index, fill_value=space_saving.min_count
+                ),
+                count_min.estimate(exact.index.to_numpy()),
+            )
+            rows.append(
+                {
+                    "k": k,
+                    "width": width,
+                    "depth": depth,
+                    "kib": (space_saving.nbytes() + count_min.nbytes()) / 1024,
+                    "exact_kib": exact_kib,
+                    f"recall_top{top_n}": len(found) / top_n,
+                    "max_rel_error": float(((estimates - exact) / exact).max()),
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+@app.command()
+def report(
+    k: List[int] = typer.Option([50, 200, 1000], help="SpaceSaving sizes"),
+    width: List[int] = typer.Option([1024, 8192], help="Count-Min widths"),
+    depth: int = typer.Option(4, help="Count-Min depth"),
+    top_n: int = typer.Option(20, help="Length of the compared top lists"),
+    workers: int = typer.Option(None, help="Worker processes, default one per cpu"),
+):
+    """Compare sketch top names with the exact counts"""
+    typer.echo(
+        accuracy_report(k, width, depth=depth, top_n=top_n, workers=workers).to_string(
+            index=False
+        )
+    )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,137 @@
+"""Pre-rendered figures of the dashboard's default views
+
+Run from the bin folder:
+    python -m dev.snapshots
+    python -m dev.snapshots --source ../data/names_combined_features.csv --html
+
+Most visits only see the default state of a page (Home with all kiez, all
+genders and all name positions, Genders with the "True Unisex" range). The
+build renders those figures with the same functions the app uses and writes
+them to data/snapshots/<dataset version>/<view>.json. The app shows a
+snapshot while the widgets are at their defaults and computes the figures
+live as soon as one changes. A new dataset has a new version, so outdated
+snapshots are never shown. Snapshots are build output and not committed,
+like the .arrow files and data/feature_state; build them where the app runs.
+"""
+
+import json
+import pathlib
+
+import plotly.utils
+import typer
+
+import dev.dataset as ds
+import dev.queries as queries
+import dev.streamlit_helper_functions as sf
+
+SNAPSHOT_PATH = (
+    pathlib.Path(__file__) / ".." / ".." / ".." / "data" / "snapshots"
+).resolve()
+
+# figures of the snapshots read so far by (path, version, view)
+_loaded = {}
+
+app = typer.Typer()
+
+
+def home_figures(names):
+    """Figures of the Home page with all kiez, genders, positions and names"""
+    selection, kiez_str = sf.kiez_selection(names, [])
+    name_list = names.loc[:, "vorname"].cat.remove_unused_categories().cat.categories
+    return {
+        "kiez_timeseries": sf.kiez_timeseries_figure(selection, kiez_str),
+        "name_heatmap": sf.name_heatmap_figure(sf.name_selection(names, name_list)),
+    }
+
+
+def gender_figures(names):
+    """Figures of the Genders page with all positions and the "True Unisex" range"""
+    return {
+        "gender_histogram": sf.gender_histogram_figure(names),
+        "gender_category": sf.gender_category_figure(names, queries.GENDER_LABELS[2]),
+    }
+
+
+VIEWS = {
+    "home": home_figures,
+    "genders": gender_figures,
+}
+
+
+def build_snapshots(
+    source: str = ds.FEATURES_URL,
+    path: pathlib.Path = SNAPSHOT_PATH,
+    html: bool = False,
+):
+    """Renders the default views of the dataset at source
+
+    Args:
+        source (str, optional): url or path of names_combined_features.csv
+        path (pathlib.Path, optional): snapshot folder
+        html (bool, optional): also write every figure as standalone html
+
+    Returns:
+        pathlib.Path: folder of this dataset version's snapshots
+    """
+    names = ds.load_names(source)
+    version = ds.dataset_version(source)
+    target = path / version
+    target.mkdir(parents=True, exist_ok=True)
+    for view, figures in VIEWS.items():
+        figures = figures(names)
+        snapshot = {
+            "version": version,
+            "view": view,
+            "figures": {name: fig.to_plotly_json() for name, fig in figures.items()},
+        }
+        with open(target / f"{view}.json", "w") as f:
+            json.dump(snapshot, f, cls=plotly.utils.PlotlyJSONEncoder)
+        if html:
+            for name, fig in figures.items():
+                fig.write_html(target / f"{view}_{name}.html", include_plotlyjs="cdn")
+    return target
+
+
+def load_snapshot(version: str, view: str, path: pathlib.Path = SNAPSHOT_PATH):
+    """Pre-rendered figures of a view, read once per process
+
+    Only found snapshots are kept, a missing one is looked up again on the
+    next call, so snapshots built after the app started are served.
+
+    Args:
+        version (str): dataset version, see `dataset.dataset_version`
+        view (str): one of VIEWS
+        path (pathlib.Path, optional): snapshot folder
+
+    Returns:
+        dict: plotly figure dicts by name, None if there is no snapshot
+    """
+    key = (path, version, view)
+    if key not in _loaded:
+        try:
+            with open(path / version / f"{view}.json") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        _loaded.setdefault(key, snapshot["figures"])
+    return _loaded[key]
+
+
+def default_snapshot(source: str, view: str):
+    """Snapshot of a view of the dataset at source, None if none was built"""
+    return load_snapshot(ds.dataset_version(source), view)
+
+
+@app.command()
+def build(
+    source: str = typer.Option(None, help="Dataset url or path, default as the app"),
+    html: bool = typer.Option(False, help="Also write standalone html figures"),
+):
+    """Render the default views of the dataset"""
+    ds.enable_copy_on_write()
+    target = build_snapshots(source or ds.default_source(), html=html)
+    typer.echo(f"snapshots written to {target}")
+
+
+if __name__ == "__main__":
+    app()
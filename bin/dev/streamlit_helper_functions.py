@@ -3,13 +3,33 @@ import plotly.figure_factory as ff
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from Levenshtein import distance
 from wordcloud import WordCloud
 import matplotlib.pyplot as plt
+import dev.dataset as ds
+import dev.kiez_map as kiez_map
+import dev.queries as queries
+
+# widgets whose defaults the pre-rendered snapshots show, see dev/snapshots.py
+DEFAULT_WIDGETS = {"name_position": "All", "gender": "all"}
+
+
+def at_defaults(*keys):
+    """Whether the keyed widgets still have their default values
+
+    Args:
+        keys (str): keys of DEFAULT_WIDGETS
+
+    Returns:
+        bool: True if none of them was changed
+    """
+    return all(
+        st.session_state.get(key, DEFAULT_WIDGETS[key]) == DEFAULT_WIDGETS[key]
+        for key in keys
+    )
 
 
 def filter_gender(names: pd.DataFrame):
-    gender = st.radio("Registered gender", ["all", "girls", "boys"])
+    gender = st.radio("Registered gender", ["all", "girls", "boys"], key="gender")
     if gender == "girls":
         selection = names.loc[names.loc[:, "geschlecht"] == "w", :]
     elif gender == "boys":
@@ -39,6 +59,7 @@ def name_position_radio(names: pd.DataFrame):
         "Name position. Default is 'All' to include data between 2012 and 2016",
         ["All"] + positions,
         value="All",
+        key="name_position",
     )
     if position is not "All":
         names = names.loc[names.loc[:, "position"] == int(position), :]
@@ -46,11 +67,11 @@ def name_position_radio(names: pd.DataFrame):
     return names
 
 
-def plot_name_heatmap(df):
-    df = df.groupby(["kiez", "jahr"]).sum().sort_values("anzahl")
+def name_heatmap_figure(df):
+    df = df.groupby(["kiez", "jahr"], observed=True)[["anzahl"]].sum()
 
     pivot_table = pd.pivot_table(
-        df, values="anzahl", index="kiez", columns="jahr", fill_value=0
+        df, values="anzahl", index="kiez", columns="jahr", fill_value=0, observed=True
     ).astype("int")
 
     sorted_pivot_table = pivot_table.sort_values(by=pivot_table.columns.tolist())
@@ -64,12 +85,18 @@ def plot_name_heatmap(df):
     )
 
     fig.update_layout(title="Name counts*", xaxis_title="Year", yaxis_title="Kiez")
+    return fig
 
-    st.plotly_chart(fig, use_container_width=True)
+
+def plot_name_heatmap(df):
+    st.plotly_chart(name_heatmap_figure(df), use_container_width=True)
 
 
 def multiselect_names(names: pd.DataFrame):
-    name_list = list(names.sort_values("vorname").loc[:, "vorname"].unique())
+    # categories are sorted, only keep those present in this selection
+    name_list = list(
+        names.loc[:, "vorname"].cat.remove_unused_categories().cat.categories
+    )
     name_selection = st.multiselect(
         "Enter a name: ",
         options=name_list,
@@ -79,39 +106,85 @@ def multiselect_names(names: pd.DataFrame):
     return name_selection
 
 
-def name_selector(names: pd.DataFrame):
-    names_subset = names.loc[:, ["vorname_", "kiez", "geschlecht", "jahr", "anzahl"]]
-    names_subset["vorname"] = names_subset["vorname_"].apply(lambda x: x.split("_")[0])
-    name_list = multiselect_names(names_subset)
-    selection = names_subset.loc[names_subset.loc[:, "vorname"].isin(name_list), :]
+def name_selection(names: pd.DataFrame, name_list: list):
+    names_subset = names.loc[:, ["vorname", "kiez", "geschlecht", "jahr", "anzahl"]]
+    return names_subset.loc[names_subset.loc[:, "vorname"].isin(name_list), :]
+
+
+def name_profile_view(profile: dict):
+    """Shows a name's profile, see `queries.name_profile`"""
+    st.subheader(profile["vorname"])
+    columns = st.columns(4)
+    columns[0].metric("Babies", f"{profile['total']:,}")
+    columns[1].metric("Given", f"{profile['first_year']} - {profile['last_year']}")
+    columns[2].metric("Peak year", profile["peak_year"])
+    columns[3].metric("Share of girls", f"{profile['gender_scale']:.0%}")
+    st.caption(f"Most babies were registered in {profile['peak_kiez']}")
+
+    counts, ranks = st.columns(2)
+    counts.plotly_chart(
+        px.bar(profile["anzahl"], labels={"value": "Babies"}).update_layout(
+            showlegend=False
+        ),
+        use_container_width=True,
+    )
+    # rank 0 means the name was not given that year
+    fig = px.line(
+        profile["rank"].where(profile["rank"] > 0),
+        markers=True,
+        labels={"value": "Rank among all names"},
+    )
+    fig.update_layout(showlegend=False)
+    fig.update_yaxes(autorange="reversed")
+    ranks.plotly_chart(fig, use_container_width=True)
+
+
+def name_selector(names: pd.DataFrame, snapshot: dict = None, source: str = None):
+    """Select names and plot their counts per kiez and year
+
+    Args:
+        names (pd.DataFrame): names dataset
+        snapshot (dict, optional): pre-rendered default view, shown while no
+            name is selected
+        source (str, optional): url or path of the dataset, if given a single
+            selected name is shown from its precomputed profile
+
+    Returns:
+        pd.DataFrame: rows of the selected names, None if the snapshot or a
+            profile was shown
+    """
+    name_list = multiselect_names(names)
+    # an empty selection stands for all names
+    if snapshot is not None and len(name_list) == names.loc[:, "vorname"].nunique():
+        st.plotly_chart(snapshot["name_heatmap"], use_container_width=True)
+        return None
+    if source is not None and len(name_list) == 1:
+        profiles = ds.load_profiles(source)
+        if name_list[0] in profiles.index:
+            name_profile_view(queries.name_profile(profiles, name_list[0]))
+            return None
+    selection = name_selection(names, name_list)
 
     # Plot heatmap
     plot_name_heatmap(selection)
     return selection
 
 
-def kiez_selector(names: pd.DataFrame):
-    """Select Kiez
-    Plot something
+def kiez_selection(names: pd.DataFrame, selected_kiez: list):
+    """Names of the selected kiez summed per name, gender and year
 
     Args:
-        kiez_names (_type_): selector for berlin kiez names
+        names (pd.DataFrame): names dataset
+        selected_kiez (list): kiez names, all kiez if empty
 
     Returns:
-        pd.DataFrame: for all berlin or selected kiez
+        tuple: the summed pd.DataFrame and the kiez as a string for titles
     """
     names_subset_kiez = names.loc[
-        :, ["vorname_", "kiez", "geschlecht", "jahr", "anzahl"]
+        :, ["vorname", "kiez", "geschlecht", "jahr", "anzahl"]
     ]
-    names_subset_kiez["vorname"] = names_subset_kiez["vorname_"].apply(
-        lambda x: x.split("_")[0]
-    )
-    kiez_names = list(names_subset_kiez.loc[:, "kiez"].unique())
-
-    # Get user's selections
-    selected_kiez = st.multiselect("Filter by Kiez:", kiez_names)
     if selected_kiez == []:
-        selected_kiez = kiez_names
+        selected_kiez = list(names_subset_kiez.loc[:, "kiez"].unique())
 
     selection = names_subset_kiez[
         names_subset_kiez["kiez"].isin(selected_kiez)
@@ -126,91 +199,114 @@ def kiez_selector(names: pd.DataFrame):
 
     selection = (
         selection.drop("kiez", axis=1)
-        .groupby(["vorname", "geschlecht", "jahr"])
+        .groupby(["vorname", "geschlecht", "jahr"], observed=True)
         .sum()
         .reset_index()
         .sort_values(by="anzahl", ascending=False)
     )
+    return selection, kiez_str
+
 
+def kiez_selector(names: pd.DataFrame, snapshot: dict = None):
+    """Select Kiez
+    Plot something
+
+    Args:
+        kiez_names (_type_): selector for berlin kiez names
+        snapshot (dict, optional): pre-rendered default view, shown while no
+            kiez is selected
+
+    Returns:
+        pd.DataFrame: for all berlin or selected kiez, None if the snapshot was
+            shown
+    """
+    kiez_names = list(names.loc[:, "kiez"].unique())
+
+    # Get user's selections
+    selected_kiez = st.multiselect("Filter by Kiez:", kiez_names)
+    if selected_kiez == [] and snapshot is not None:
+        st.plotly_chart(snapshot["kiez_timeseries"], use_container_width=True)
+        return None
+
+    selection, kiez_str = kiez_selection(names, selected_kiez)
     kiez_selection_to_timeseries(selection, kiez_str)
 
     return selection
 
 
-def kiez_selection_to_timeseries(names: pd.DataFrame, kiez_string):
-    """Generate a name count timeseries for visualization
+def kiez_timeseries_figure(names: pd.DataFrame, kiez_string):
+    """Timeseries of the top 30 names in 2022
 
     Args:
         names (pd.DataFrame): Takes the names dataframe, with or without 'kiez' information
+        kiez_string (str): kiez for the title
 
     Returns:
-        _type_: _description_
+        go.Figure: one line per name
     """
 
-    names_ts = names.pivot_table(index="vorname", columns="jahr", values="anzahl")
+    names_ts = names.pivot_table(
+        index="vorname", columns="jahr", values="anzahl", observed=True
+    )
     names_ts = names_ts.sort_values(by=2022, ascending=False).head(30).T  # .astype(int)
     names_ts.index = pd.to_datetime(names_ts.index, format="%Y").strftime("%Y")
     names_ts = names_ts.fillna(0).astype(int).sort_index(ascending=True)
 
-    fig = px.line(names_ts, title=f"{kiez_string}'s top 30 names in 2022")
+    return px.line(names_ts, title=f"{kiez_string}'s top 30 names in 2022")
+
+
+def kiez_selection_to_timeseries(names: pd.DataFrame, kiez_string):
+    """Generate a name count timeseries for visualization
+
+    Args:
+        names (pd.DataFrame): Takes the names dataframe, with or without 'kiez' information
+
+    Returns:
+        _type_: _description_
+    """
+    fig = kiez_timeseries_figure(names, kiez_string)
     st.plotly_chart(fig, use_container_width=True)
 
 
-def gender_viz1(names):
-    df = names.copy()
+def gender_histogram_figure(df: pd.DataFrame):
+    """Number of names per gender score range
 
-    # Start streamlit app
-    st.header("Gender Visualization")
-    st.markdown(
-        "Using the assigned gender at birth, it is possible to assign a 'unisex score' to the names, where a score of 0 means the name was only assigned to either males or females, while 1 was assigned equally to males and females. This has no connection to the chosen gender of the individual. The following graphs represent the entire dataset (2012-2022)."
-    )
+    Args:
+        df (pd.DataFrame): names with a "gender_scale" column
 
-    # Select name position
-    df = name_position_radio(df)
+    Returns:
+        go.Figure: bar chart over queries.GENDER_LABELS
+    """
     # Calculate the gender score bins
-    bins = [0.0, 0.2, 0.4, 0.6, 0.8, 1.0]
-    labels = [
-        "Predominantly Male",
-        "Male-leaning Unisex",
-        "True Unisex",
-        "Female-leaning Unisex",
-        "Predominantly Female",
-    ]
-    df["gender_category"] = pd.cut(df["gender_scale"], bins=bins, labels=labels)
+    labels = queries.GENDER_LABELS
+    gender_category = pd.cut(
+        df["gender_scale"], bins=queries.GENDER_BINS, labels=labels
+    )
 
     # Calculate the number of names in each gender score bin
-    bin_counts = df["gender_category"].value_counts().sort_index()
+    bin_counts = gender_category.value_counts().sort_index()
 
     # Plot the histogram of names per bin
-    hist_fig = px.bar(
+    return px.bar(
         x=labels,
         y=bin_counts,
         labels={"x": "Gender Score Range", "y": "Number of Names"},
         title="Number of Names per Gender Score Range",
     )
-    st.plotly_chart(hist_fig, use_container_width=True)
 
-    # Let the user select a gender score bin
-    selected_category = st.select_slider(
-        "Select a Gender Score Range", labels, value="True Unisex"
-    )
 
-    # Filter the DataFrame for names within the selected gender score bin
-    df_category = df[df["gender_category"] == selected_category]
+def gender_category_figure(df: pd.DataFrame, selected_category: str):
+    """Names of one gender score range, outliers labelled
 
-    # Aggregate the filtered DataFrame by name (taking the sum of 'anzahl')
-    df_category = (
-        df_category.groupby("vorname")
-        .agg(
-            {
-                "anzahl": "sum",
-                "gender_scale": "mean",
-                "unisex_score": "mean",
-            }
-        )
-        .reset_index()
-        .sort_values(["gender_scale"], ascending=[True])
-    )
+    Args:
+        df (pd.DataFrame): names with "gender_scale" and "unisex_score" columns
+        selected_category (str): one of queries.GENDER_LABELS
+
+    Returns:
+        go.Figure: bar chart of the names' total counts
+    """
+    # Names within the selected gender score bin, aggregated by name
+    df_category = queries.gender_category_names(df, selected_category)
 
     # Create a bar plot with names on x-axis and 'anzahl' on y-axis
     # Colors are set based on 'gender_scale'
@@ -258,11 +354,47 @@ def gender_viz1(names):
         customdata=df_category[["unisex_score", "gender_scale"]].values,
     )
 
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
+
+
+def gender_viz1(names, snapshot: dict = None):
+    """Gender score ranges and the names of the selected range
+
+    Args:
+        names (pd.DataFrame): names dataset
+        snapshot (dict, optional): pre-rendered default view, shown while the
+            widgets are at their defaults
+    """
+    df = names
+
+    # Start streamlit app
+    st.header("Gender Visualization")
+    st.markdown(
+        "Using the assigned gender at birth, it is possible to assign a 'unisex score' to the names, where a score of 0 means the name was only assigned to either males or females, while 1 was assigned equally to males and females. This has no connection to the chosen gender of the individual. The following graphs represent the entire dataset (2012-2022)."
+    )
+
+    # Select name position
+    df = name_position_radio(df)
+    if not at_defaults("name_position"):
+        snapshot = None
+    if snapshot is not None:
+        st.plotly_chart(snapshot["gender_histogram"], use_container_width=True)
+    else:
+        st.plotly_chart(gender_histogram_figure(df), use_container_width=True)
+
+    # Let the user select a gender score bin
+    selected_category = st.select_slider(
+        "Select a Gender Score Range", queries.GENDER_LABELS, value="True Unisex"
+    )
+    if snapshot is not None and selected_category == "True Unisex":
+        st.plotly_chart(snapshot["gender_category"], use_container_width=True)
+    else:
+        fig = gender_category_figure(df, selected_category)
+        st.plotly_chart(fig, use_container_width=True)
 
 
 def gender_viz2(names):
-    df = names.copy()
+    df = names
 
     # Start streamlit app
     st.header("Gender Visualization")
@@ -361,15 +493,6 @@ def gender_viz2(names):
     st.plotly_chart(fig_bar, use_container_width=True)
 
 
-def levenshtein_similarity(name, names, n=10):
-    """Find the `n` names most similar to `name` based on Levenshtein distance."""
-    distances = [(other_name, distance(name, other_name)) for other_name in names]
-    distances.sort(key=lambda x: x[1])
-    return {
-        name: dist for name, dist in distances[:n]
-    }  # [name for name, dist in distances[:n]]
-
-
 def plot_word_cloud(names):
     """Plot a word cloud from a list of names."""
     wordcloud = WordCloud(width=800, height=400, background_color="white").generate(
@@ -382,14 +505,76 @@ def plot_word_cloud(names):
 
 
 def similar_names(names: pd.DataFrame):
-    names_subset = names.loc[:, ["vorname_", "kiez", "geschlecht", "jahr", "anzahl"]]
-    names_subset["vorname"] = names_subset["vorname_"].apply(lambda x: x.split("_")[0])
-
     selected_names = multiselect_names(names)
-    all_names = list(names_subset.sort_values("vorname").loc[:, "vorname"].unique())
     st.text([len(selected_names), len(names)])
 
     if len(selected_names) == 1:
         for n in selected_names:
-            similar = levenshtein_similarity(n, all_names, n=20)
+            similar = queries.similar_names(names, n, n=20)
             st.text(f"Levenshtein similarity: {similar}")
+
+            if "cluster_id" in names.columns:
+                variants = queries.name_variants(names, n)
+                st.text(
+                    f"Spelling variants: {variants['anzahl'].sum()} babies "
+                    f"across {len(variants)} spellings"
+                )
+                st.plotly_chart(
+                    px.bar(variants.head(30), x="vorname", y="anzahl"),
+                    use_container_width=True,
+                )
+
+
+@st.cache_resource
+def _kiez_map_figure(version: str, metric: str, _names: pd.DataFrame):
+    """Map figure per dataset and metric, built once per process"""
+    metrics = kiez_map.kiez_year_metrics(_names)
+    return kiez_map.choropleth_figure(metrics, kiez_map.load_geometry(), metric)
+
+
+def names_by_kiez(names: pd.DataFrame, version: str):
+    """Plots a map of berlin with the popular names every year
+
+    Args:
+        names (pd.DataFrame): names dataset
+        version (str): its version, see `dataset.dataset_version`
+    """
+    metrics = {label: metric for metric, label in kiez_map.METRICS.items()}
+    metric = metrics[st.radio("Color by", list(metrics), horizontal=True)]
+    fig = _kiez_map_figure(version, metric, names)
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption(kiez_map.GEOMETRY_SOURCE)
+
+
+DIVERSITY_METRICS = {
+    "Effective number of names": "effective_names",
+    "Shannon entropy": "entropy",
+    "Gini coefficient": "gini",
+    "Share of the top 10 names": "top_share",
+}
+
+
+def diversity_view(diversity: pd.DataFrame):
+    """Plots the name diversity of every kiez over the years"""
+    label = st.radio("Metric", list(DIVERSITY_METRICS), horizontal=True)
+    metric = DIVERSITY_METRICS[label]
+    gender = st.radio("Registered gender", ["girls", "boys"], horizontal=True)
+    selection = diversity.loc[
+        diversity.loc[:, "geschlecht"] == ("w" if gender == "girls" else "m"), :
+    ]
+
+    fig = px.line(
+        selection,
+        x="jahr",
+        y=metric,
+        color="kiez",
+        markers=True,
+        labels={"jahr": "Year", metric: label},
+        title=f"{label} of first names given to {gender}",
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption(
+        "Effective number of names: how many equally popular names would give "
+        "the same entropy. Gini: 0 if every name is given equally often, "
+        "close to 1 if few names dominate."
+    )
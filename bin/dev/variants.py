@@ -0,0 +1,266 @@
+"""Spelling-variant clusters of names, e.g. Sophie, Sofie, Sophia and Zofia
+
+Names are compared by a phonetic spelling (`phonetic_spelling`, "Sophie" ->
+"sofie"). Candidate pairs come from two blockings instead of comparing all
+pairs of names:
+    - the phonetic key, the phonetic spelling without its final vowels
+      ("sofie" -> "sof"): names sharing it are variants. Stems shorter than
+      three letters keep the full spelling, or "Ella", "Eli" and "Eloy"
+      would all share "el"
+    - one-letter deletions of long phonetic spellings: every pair within edit
+      distance one shares one, and is a variant if the Levenshtein distance
+      confirms it, both have the same first sound, and they differ either
+      in a consonant only ("Maximilian", "Maximiliam") or in a vowel only
+      ("Mohammed", "Mohammad")
+
+Each name is linked to its most frequent variant only (names without a more
+frequent variant to their most frequent one), and the links are joined into
+clusters with union-find. Linking every candidate pair would chain whole
+alphabets into one cluster (Lena - Lina - Luna - ...).
+
+The final vowel often marks the gender (Leon - Leonie, Emil - Emilia,
+Mario - Maria), so no cluster spans gender scales further apart than
+MAX_GENDER_GAP: names link to their most frequent variant of a close gender
+scale, and a link that would still widen a cluster beyond it is dropped, or
+unisex names would chain Elisei - Ellis - Elisa.
+"""
+
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+from Levenshtein import distance
+
+# phonetic spellings shorter than this only match by phonetic key
+MIN_DELETION_LENGTH = 7
+# phonetic keys shorter than this only match the full phonetic spelling
+MIN_KEY_LENGTH = 3
+# gender scales within a cluster differ by at most this
+MAX_GENDER_GAP = 0.5
+
+_REPLACEMENTS = [
+    ("ph", "f"),
+    ("th", "t"),
+    ("ck", "k"),
+    ("qu", "kv"),
+    ("y", "i"),
+    ("w", "v"),
+    ("z", "s"),
+]
+_FIRST_SOUNDS = {"c": "k", "z": "s", "y": "i", "v": "f", "w": "f"}
+# an initial y before a vowel is a consonant, "Yusuf" sounds like "Jusuf"
+_INITIAL_Y = "^y(?=[aeiou])"
+
+
+def _plain(name: str):
+    name = unicodedata.normalize("NFKD", name.lower().replace("ß", "ss"))
+    return "".join(c for c in name if "a" <= c <= "z")
+
+
+def phonetic_spelling(name: str):
+    """Spelling of a name with sound-alike letters unified, e.g. "Sophie" -> "sofie"
+
+    Args:
+        name (str): name, accents are dropped
+
+    Returns:
+        str: lower case spelling without doubled letters or silent h
+    """
+    spelling = re.sub(_INITIAL_Y, "j", _plain(name))
+    for letters, sound in _REPLACEMENTS:
+        spelling = spelling.replace(letters, sound)
+    spelling = re.sub("c(?=[aouklr]|$)", "k", spelling)
+    spelling = re.sub("(?<=[aeiou])h(?![aeiou])", "", spelling)
+    return re.sub(r"(.)\1+", r"\1", spelling)
+
+
+def phonetic_key(spelling: str):
+    """Blocking key of a phonetic spelling, "sofie" -> "sof"
+
+    Spellings that only differ in their final vowels share it, short stems
+    keep the full spelling ("mia" stays "mia", so it doesn't match "mo").
+    """
+    stem = re.sub("[aeiou]+$", "", spelling)
+    return stem if len(stem) >= MIN_KEY_LENGTH else spelling
+
+
+def _first_sound(name: str):
+    plain = re.sub(_INITIAL_Y, "j", _plain(name))
+    if plain.startswith("ph"):
+        return "f"
+    return _FIRST_SOUNDS.get(plain[:1], plain[:1])
+
+
+def _vowels(spelling: str):
+    return "".join(re.findall("[aeiou]+", re.sub("[aeiou]+$", "", spelling)))
+
+
+def _consonants(spelling: str):
+    return re.sub("[aeiou]+", "", spelling)
+
+
+def _deletions(spelling: str):
+    return {spelling[:i] + spelling[i + 1 :] for i in range(len(spelling))} | {spelling}
+
+
+def candidate_pairs(vornamen: pd.Series):
+    """Pairs of variants found through the blocking keys
+
+    Args:
+        vornamen (pd.Series): unique names
+
+    Returns:
+        pd.DataFrame: "left", "right" positions into `vornamen`, each pair once
+    """
+    spellings = vornamen.map(phonetic_spelling)
+    keys = pd.concat(
+        [
+            "p" + spellings.map(phonetic_key),
+            "d"
+            + spellings.loc[spellings.str.len() >= MIN_DELETION_LENGTH]
+            .map(_deletions)
+            .explode(),
+        ]
+    )
+    keys = keys.rename("key").rename_axis("left").reset_index()
+    pairs = keys.merge(keys.rename(columns={"left": "right"}), on="key")
+    pairs = pairs.loc[pairs.loc[:, "left"] < pairs.loc[:, "right"], :]
+    pairs = (
+        pairs.assign(by_key=pairs.loc[:, "key"].str.startswith("p"))
+        .groupby(["left", "right"], as_index=False)["by_key"]
+        .max()
+    )
+    by_key = pairs.loc[:, "by_key"]
+
+    # pairs from the deletions need a confirmed distance, the same first sound
+    # and either the same vowels or only a different vowel (Mohammed, Mohammad)
+    deletion = pairs.loc[~by_key, ["left", "right"]]
+    left = deletion.loc[:, "left"].to_numpy()
+    right = deletion.loc[:, "right"].to_numpy()
+    spelling_array = spellings.to_numpy()
+    first = vornamen.map(_first_sound).to_numpy()
+    vowels = spellings.map(_vowels).to_numpy()
+    consonants = spellings.map(_consonants).to_numpy()
+    confirmed = (
+        np.array(
+            [
+                distance(spelling_array[i], spelling_array[j])
+                for i, j in zip(left, right)
+            ],
+            dtype=int,
+        )
+        <= 1
+    )
+    confirmed &= (first[left] == first[right]) & (
+        (vowels[left] == vowels[right]) | (consonants[left] == consonants[right])
+    )
+
+    pairs = pd.concat(
+        [
+            pairs.loc[by_key, ["left", "right"]],
+            deletion.loc[confirmed, :],
+        ]
+    )
+    return pairs.reset_index(drop=True)
+
+
+def _find(parent: np.ndarray, i: int):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def union_find(n: int, pairs, values: np.ndarray = None, max_spread: float = None):
+    """Connected components of n items
+
+    Args:
+        n (int): number of items
+        pairs (iterable): (i, j) pairs of linked items, joined in this order
+        values (np.ndarray, optional): value per item, NaN for unknown
+        max_spread (float, optional): pairs that would join components whose
+            values span more than this are skipped
+
+    Returns:
+        np.ndarray: root of every item's component, its smallest item
+    """
+    parent = np.arange(n)
+    if values is not None:
+        low = np.array(values, dtype=float)
+        high = low.copy()
+    for i, j in pairs:
+        root_i, root_j = _find(parent, i), _find(parent, j)
+        if root_i == root_j:
+            continue
+        if values is not None:
+            joined_low = np.fmin(low[root_i], low[root_j])
+            joined_high = np.fmax(high[root_i], high[root_j])
+            if joined_high - joined_low > max_spread:
+                continue
+        # the smaller item stays root, so roots don't depend on pair order
+        root, child = min(root_i, root_j), max(root_i, root_j)
+        parent[child] = root
+        if values is not None:
+            low[root], high[root] = joined_low, joined_high
+    return np.array([_find(parent, i) for i in range(n)], dtype=int)
+
+
+def variant_clusters(names: pd.DataFrame):
+    """Cluster id per name, the smallest name_id of its cluster
+
+    Args:
+        names (pd.DataFrame): "name_id", "vorname" and total "anzahl", one row
+            per name, optionally the "gender_scale" to keep male and female
+            names apart
+
+    Returns:
+        pd.Series: "cluster_id" indexed by name_id
+    """
+    names = names.sort_values("name_id").reset_index(drop=True)
+    pairs = candidate_pairs(names.loc[:, "vorname"].astype(str))
+    scale = None
+    if "gender_scale" in names:
+        scale = names.loc[:, "gender_scale"].to_numpy(dtype=float)
+        gap = np.abs(scale[pairs.loc[:, "left"]] - scale[pairs.loc[:, "right"]])
+        pairs = pairs.loc[~(gap > MAX_GENDER_GAP), :]
+
+    # link every name to its most frequent variant, ties to the smaller name_id
+    anzahl = names.loc[:, "anzahl"].to_numpy()
+    links = pd.concat(
+        [
+            pairs,
+            pairs.rename(columns={"left": "right", "right": "left"}),
+        ]
+    )
+    links["anzahl"] = anzahl[links.loc[:, "right"]]
+    links = links.sort_values(
+        ["anzahl", "right"], ascending=[False, True], kind="stable"
+    )
+    upward = (links.loc[:, "anzahl"] > anzahl[links.loc[:, "left"]]) | (
+        (links.loc[:, "anzahl"] == anzahl[links.loc[:, "left"]])
+        & (links.loc[:, "right"] < links.loc[:, "left"])
+    )
+    # names without a more frequent variant link to their most frequent one,
+    # or frequent spellings whose variants lean to different sides stay
+    # apart (Mohammad's variant Mohammed links to the more frequent Muhammed)
+    upward_links = links.loc[upward, :].drop_duplicates("left")
+    links = pd.concat(
+        [
+            upward_links,
+            links.loc[~links.loc[:, "left"].isin(upward_links.loc[:, "left"]), :],
+        ]
+    ).drop_duplicates("left")
+    links = links.sort_values(
+        ["anzahl", "right"], ascending=[False, True], kind="stable"
+    )
+
+    # frequent names are joined first, so they decide a cluster's gender
+    roots = union_find(
+        len(names),
+        links.loc[:, ["left", "right"]].to_numpy(),
+        scale,
+        MAX_GENDER_GAP,
+    )
+    ids = names.loc[:, "name_id"].to_numpy()
+    return pd.Series(ids[roots], index=pd.Index(ids, name="name_id"), name="cluster_id")